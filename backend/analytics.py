@@ -0,0 +1,160 @@
+# تحلیل مدت زمان ماندن درخواست‌ها در هر مرحله بر اساس تاریخچه گردش کار
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dates import as_datetime
+
+WORKFLOWS = ("goods", "payment", "proposal")
+GROUP_BY_COLUMNS = {"cost_center": "cost_center", "actor": "actor"}
+
+# تاریخچه درخواست پرداخت وضعیت مقصد را ثبت نمی‌کند؛ از روی نوع اقدام استخراج می‌شود
+PAYMENT_ACTION_STATUS = {
+    "created": "draft",
+    "submitted": "pending_financial",
+    "reviewed_by_financial": "pending_dev_manager",
+    "rejected_by_financial": "draft",
+    "approved_by_dev_manager": "pending_payment",
+    "rejected_by_dev_manager": "rejected",
+    "completed": "completed",
+}
+
+# اقدام‌هایی در درخواست کالا که وضعیت را تغییر می‌دهند ولی to_status ندارند
+GOODS_ACTION_STATUS = {
+    "receipt_added": "pending_receipt",
+    "invoice_uploaded": "pending_financial",
+}
+
+STAGE_COLUMNS = ["entity_id", "stage", "entered_at", "exited_at", "hours", "actor", "cost_center"]
+
+
+def _status_after(workflow: str, entry: Dict[str, Any]) -> Optional[str]:
+    if workflow == "payment":
+        return PAYMENT_ACTION_STATUS.get(entry.get('action'))
+    if entry.get('to_status'):
+        return entry['to_status']
+    if workflow == "goods":
+        return GOODS_ACTION_STATUS.get(entry.get('action'))
+    return None
+
+
+def _cost_center(workflow: str, doc: Dict[str, Any]) -> Optional[str]:
+    if workflow == "goods":
+        return doc.get('cost_center')
+    if workflow == "payment":
+        return (doc.get('payment_row') or {}).get('cost_center')
+    return None
+
+
+def build_stage_rows(workflow: str, docs: Iterable[Dict[str, Any]]) -> pd.DataFrame:
+    events = []
+    for doc in docs:
+        cost_center = _cost_center(workflow, doc)
+        for entry in doc.get('history') or []:
+            stage = _status_after(workflow, entry)
+            if stage is None or not entry.get('timestamp'):
+                continue
+            stage = stage.value if isinstance(stage, Enum) else str(stage)
+            events.append((doc['id'], stage, as_datetime(entry['timestamp']), entry.get('actor_name'), cost_center))
+
+    if not events:
+        return pd.DataFrame(columns=STAGE_COLUMNS)
+
+    df = pd.DataFrame(events, columns=["entity_id", "stage", "entered_at", "actor", "cost_center"])
+    df['entered_at'] = pd.to_datetime(df['entered_at'], utc=True)
+    df = df.sort_values(["entity_id", "entered_at"], kind="stable")
+
+    # ورودهای پشت‌سرهم به یک وضعیت (مثلا چند رسید) یک مرحله حساب می‌شوند
+    by_entity = df.groupby("entity_id", sort=False)
+    df = df[df['stage'] != by_entity['stage'].shift()]
+
+    by_entity = df.groupby("entity_id", sort=False)
+    df = df.assign(
+        exited_at=by_entity['entered_at'].shift(-1),
+        # کسی که درخواست را از این مرحله خارج کرده است
+        actor=by_entity['actor'].shift(-1),
+    )
+    df['hours'] = (df['exited_at'] - df['entered_at']).dt.total_seconds() / 3600.0
+    return df[STAGE_COLUMNS].reset_index(drop=True)
+
+
+def summarize(rows: pd.DataFrame, group_by: Optional[str] = None) -> List[Dict[str, Any]]:
+    keys = ["stage"] + ([GROUP_BY_COLUMNS[group_by]] if group_by else [])
+    if rows.empty:
+        return []
+
+    closed = rows[rows['hours'].notna()]
+    open_counts = rows[rows['hours'].isna()].groupby(keys, dropna=False).size()
+    stats = closed.groupby(keys, dropna=False)['hours'].agg(
+        count="count",
+        median="median",
+        p90=lambda hours: float(np.percentile(hours, 90)),
+        mean="mean",
+        max="max",
+    )
+    stats = stats.join(open_counts.rename("open"), how="outer").fillna({"count": 0, "open": 0})
+
+    result = []
+    for key, row in stats.iterrows():
+        key = key if isinstance(key, tuple) else (key,)
+        item = dict(zip(keys, (None if pd.isna(k) else k for k in key)))
+        item.update({
+            "count": int(row['count']),
+            "open": int(row['open']),
+            "median_hours": None if pd.isna(row['median']) else round(float(row['median']), 2),
+            "p90_hours": None if pd.isna(row['p90']) else round(float(row['p90']), 2),
+            "mean_hours": None if pd.isna(row['mean']) else round(float(row['mean']), 2),
+            "max_hours": None if pd.isna(row['max']) else round(float(row['max']), 2),
+        })
+        result.append(item)
+    return result
+
+
+class StageDurationStore:
+    # ردیف‌های مراحل برای هر گردش کار نگه داشته می‌شود و فقط اسناد تغییرکرده دوباره پردازش می‌شوند
+    def __init__(self):
+        self.rows = {workflow: pd.DataFrame(columns=STAGE_COLUMNS) for workflow in WORKFLOWS}
+        self.watermarks = {workflow: 0 for workflow in WORKFLOWS}
+        # بزرگ‌ترین revision اعمال‌شده هر سند؛ اسنادی که دوباره (زیر واترمارک قطعی) خوانده می‌شوند رد می‌شوند
+        self.applied: Dict[str, Dict[str, int]] = {workflow: {} for workflow in WORKFLOWS}
+        self._summaries: Dict[Any, List[Dict[str, Any]]] = {}
+
+    def apply(self, workflow: str, docs: List[Dict[str, Any]]):
+        applied = self.applied[workflow]
+        docs = [doc for doc in docs if doc['id'] not in applied or (doc.get('revision') or 0) > applied[doc['id']]]
+        if not docs:
+            return
+        applied.update({doc['id']: doc.get('revision') or 0 for doc in docs})
+        ids = {doc['id'] for doc in docs}
+        current = self.rows[workflow]
+        fresh = build_stage_rows(workflow, docs)
+        kept = current[~current['entity_id'].isin(ids)]
+        self.rows[workflow] = fresh if kept.empty else pd.concat([kept, fresh], ignore_index=True)
+        self._summaries = {key: value for key, value in self._summaries.items() if key[0] != workflow}
+
+    def advance(self, workflow: str, revision: int):
+        # واترمارک فقط تا revision قطعی جلو می‌رود؛ اسناد بالاتر در بارگذاری بعدی دوباره خوانده می‌شوند
+        self.watermarks[workflow] = max(self.watermarks[workflow], revision)
+
+    def summary(
+        self,
+        workflow: str,
+        group_by: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        if start or end:
+            # بازه‌های دلخواه کش نمی‌شوند؛ فقط مراحلی که در بازه شروع شده‌اند حساب می‌شوند
+            rows = self.rows[workflow]
+            if start:
+                rows = rows[rows['entered_at'] >= pd.Timestamp(start)]
+            if end:
+                rows = rows[rows['entered_at'] < pd.Timestamp(end)]
+            return summarize(rows, group_by)
+        key = (workflow, group_by)
+        if key not in self._summaries:
+            self._summaries[key] = summarize(self.rows[workflow], group_by)
+        return self._summaries[key]
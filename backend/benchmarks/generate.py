@@ -0,0 +1,477 @@
+# تولید داده مصنوعی در حجم بالا برای آزمون مقیاس
+#
+#   cd backend && python -m benchmarks.generate --goods 1000000 --payments 200000 --proposals 20000
+#   python -m benchmarks.generate --blob-kb 0             بدون پیوست
+#   python -m benchmarks.generate --parallel 8            تعداد درج‌های همزمان
+#
+# هر سند در یک وضعیت معتبر گردش کار ساخته می‌شود و تاریخچه، استعلام‌ها، رسیدها و فیلدهای
+# هر مرحله با همان وضعیت سازگار است. شماره درخواست‌ها بر اساس سال شمسی تاریخ ایجاد
+# از شمارنده‌های برنامه رزرو می‌شوند تا با درخواست‌های بعدی تداخل نداشته باشند.
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from benchmarks.scenarios import ITEM_NAMES, attachment
+from benchmarks.seed import ROLE_USERS, seed_users
+from jalali import format_jalali, to_jalali
+from price_history import request_observations
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+DESCRIPTIONS = [
+    "برای واحد مالی نیاز فوری است",
+    "جایگزین تجهیزات فرسوده انبار",
+    "طبق برنامه خرید فصلی",
+    "درخواست مجدد پس از اصلاح مشخصات فنی",
+    None,
+]
+COST_CENTERS = ["دفتر", "قیر", "پارادیزو"]
+BANKS = ["بانک ملت", "بانک ملی", "بانک تجارت", "بانک پاسارگاد"]
+SUPPLIERS = ["شرکت پارس تجهیز", "فروشگاه نوین", "بازرگانی آریا", "شرکت صنایع شرق"]
+PROPOSAL_TITLES = ["توسعه خط تولید", "نوسازی سامانه انبار", "احداث سوله جدید", "بهبود فرایند فروش", "راه‌اندازی آزمایشگاه کیفیت"]
+PROPOSAL_OBJECTIVES = ["افزایش ظرفیت تولید", "کاهش هزینه‌های نگهداری", "بهبود کیفیت محصول", "الزام قانونی"]
+
+# وضعیت نهایی -> وزن انتخاب؛ اسناد قدیمی‌تر بیشتر در وضعیت پایانی هستند
+GOODS_WEIGHTS = {
+    "draft": 3, "pending_procurement": 5, "pending_management": 5, "pending_purchase": 4,
+    "pending_receipt": 4, "pending_invoice": 3, "pending_financial": 4, "completed": 62, "rejected": 10,
+}
+PAYMENT_WEIGHTS = {
+    "draft": 3, "pending_financial": 6, "pending_dev_manager": 5, "pending_payment": 5, "completed": 71, "rejected": 10,
+}
+PROPOSAL_WEIGHTS = {
+    "draft": 5, "pending_coo": 10, "pending_dev_manager": 10, "pending_project_control": 10, "completed": 50,
+    "rejected_by_coo": 15,
+}
+
+
+def _pick(weights: Dict[str, int]) -> str:
+    return random.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _timeline(created: datetime, steps: int, now: datetime) -> List[datetime]:
+    # زمان هر مرحله پس از مرحله قبل و پیش از اکنون
+    gaps = [random.uniform(0.5, 72) for _ in range(steps)]
+    available = (now - created).total_seconds() / 3600
+    scale = min(1.0, available / sum(gaps)) if gaps else 1.0
+    stamps, current = [], created
+    for gap in gaps:
+        current += timedelta(hours=gap * scale)
+        stamps.append(current)
+    return stamps
+
+
+class BlobPool:
+    # تعداد محدودی پیوست تصادفی که بین اسناد تکرار می‌شوند
+    def __init__(self, size_kb: int, count: int = 16):
+        self.blobs = [attachment(size_kb) for _ in range(count)] if size_kb else [None]
+
+    def pick(self) -> Optional[str]:
+        return random.choice(self.blobs)
+
+
+class Generator:
+    def __init__(self, server, requesters: List[Dict[str, str]], staff: Dict[str, Dict[str, str]], blob_kb: int, days: int):
+        self.server = server
+        self.requesters = requesters
+        self.staff = staff
+        self.blobs = BlobPool(blob_kb)
+        self.days = days
+        self.now = datetime.now(timezone.utc)
+
+    def _created_at(self) -> datetime:
+        return self.now - timedelta(days=random.uniform(0, self.days))
+
+    def _jalali_year(self, value: datetime) -> int:
+        return to_jalali(value.astimezone(self.server.REPORT_TIMEZONE).date())[0]
+
+    def _actor(self, role: str) -> Dict[str, str]:
+        user = self.staff[role]
+        return {"actor_id": user['id'], "actor_name": user['full_name']}
+
+    # ---------- درخواست کالا ----------
+    def goods(self) -> Dict[str, Any]:
+        RequestStatus, ActionType = self.server.RequestStatus, self.server.ActionType
+        requester = random.choice(self.requesters)
+        requester_actor = {"actor_id": requester['id'], "actor_name": requester['full_name']}
+        target = _pick(GOODS_WEIGHTS)
+        created = self._created_at()
+        stamps = iter(_timeline(created, 7, self.now))
+        quantity = random.randint(1, 50)
+
+        doc = {
+            "id": str(uuid.uuid4()),
+            "request_number": None,
+            "requester_id": requester['id'],
+            "requester_name": requester['full_name'],
+            "item_name": random.choice(ITEM_NAMES),
+            "quantity": quantity,
+            "cost_center": random.choice(COST_CENTERS),
+            "need_date": None,
+            "image_base64": self.blobs.pick(),
+            "description": random.choice(DESCRIPTIONS),
+            "status": RequestStatus.DRAFT.value,
+            "inquiries": [],
+            "receipts": [],
+            "invoice_base64": None,
+            "history": [],
+            "created_at": created,
+            "updated_at": created,
+        }
+
+        def step(action, to_status, actor, timestamp, notes=None):
+            doc['history'].append({
+                "action": action.value, **actor, "timestamp": timestamp, "notes": notes,
+                "from_status": doc['status'] if doc['history'] else None, "to_status": to_status.value,
+            })
+            doc['status'] = to_status.value
+            doc['updated_at'] = timestamp
+
+        step(ActionType.CREATED, RequestStatus.DRAFT, requester_actor, created)
+        if target == "draft":
+            return doc
+        step(ActionType.SUBMITTED, RequestStatus.PENDING_PROCUREMENT, requester_actor, next(stamps))
+        if target == "pending_procurement":
+            return doc
+
+        for _ in range(3):
+            unit_price = random.randint(50, 5000) * 10_000
+            doc['inquiries'].append({
+                "id": str(uuid.uuid4()), "unit_price": unit_price, "quantity": quantity,
+                "total_price": unit_price * quantity, "image_base64": self.blobs.pick(), "is_selected": False,
+            })
+        step(ActionType.INQUIRIES_ADDED, RequestStatus.PENDING_MANAGEMENT, self._actor("procurement"), next(stamps),
+             f"{len(doc['inquiries'])} استعلام ثبت شد")
+        if target == "pending_management":
+            return doc
+        if target == "rejected":
+            step(ActionType.REJECTED, RequestStatus.REJECTED, self._actor("management"), next(stamps),
+                 "عدم تایید کامل درخواست")
+            return doc
+
+        selected = min(doc['inquiries'], key=lambda inquiry: inquiry['unit_price'])
+        selected['is_selected'] = True
+        step(ActionType.APPROVED, RequestStatus.PENDING_PURCHASE, self._actor("management"), next(stamps),
+             "استعلام برنده انتخاب شد - تایید")
+        if target == "pending_purchase":
+            return doc
+
+        received_at = next(stamps)
+        receipt = {
+            "id": str(uuid.uuid4()), "receipt_number": None, "quantity": quantity,
+            "unit_price": selected['unit_price'], "total_price": selected['total_price'],
+            "confirmed_by_procurement": False, "confirmed_by_requester": False,
+            "procurement_confirmed_at": None, "requester_confirmed_at": None,
+            "procurement_receipt_date": None, "procurement_receipt_time": None,
+            "requester_receipt_date": None, "requester_receipt_time": None,
+            "created_at": received_at,
+        }
+        doc['receipts'].append(receipt)
+        step(ActionType.RECEIPT_ADDED, RequestStatus.PENDING_RECEIPT, self._actor("procurement"), received_at)
+        if target == "pending_receipt":
+            return doc
+
+        confirmed_at = next(stamps)
+        local = confirmed_at.astimezone(self.server.REPORT_TIMEZONE)
+        for side in ("procurement", "requester"):
+            receipt.update({
+                f"confirmed_by_{side}": True,
+                f"{side}_confirmed_at": confirmed_at,
+                f"{side}_receipt_date": format_jalali(local.date()),
+                f"{side}_receipt_time": local.strftime("%H:%M"),
+            })
+        doc['status'] = RequestStatus.PENDING_INVOICE.value
+        doc['updated_at'] = confirmed_at
+        if target == "pending_invoice":
+            return doc
+
+        doc['invoice_base64'] = self.blobs.pick()
+        step(ActionType.INVOICE_UPLOADED, RequestStatus.PENDING_FINANCIAL, self._actor("procurement"), next(stamps),
+             "فاکتور بارگذاری شد")
+        if target == "pending_financial":
+            return doc
+        step(ActionType.COMPLETED, RequestStatus.COMPLETED, self._actor("financial"), next(stamps))
+        return doc
+
+    # ---------- درخواست پرداخت ----------
+    def payment(self) -> Dict[str, Any]:
+        Status = self.server.PaymentRequestStatus
+        requester = random.choice(self.requesters)
+        target = _pick(PAYMENT_WEIGHTS)
+        created = self._created_at()
+        stamps = iter(_timeline(created, 4, self.now))
+        amount = random.randint(1, 2000) * 1_000_000
+
+        doc = {
+            "id": str(uuid.uuid4()),
+            "request_number": None,
+            "requester_id": requester['id'],
+            "requester_name": requester['full_name'],
+            "request_type": random.choice(list(self.server.RequestType)).value,
+            "request_type_other": None,
+            "total_amount": amount,
+            "payment_row": {
+                "id": str(uuid.uuid4()),
+                "amount": amount,
+                "invoice_contract_number": f"Q-{random.randint(10000, 99999)}",
+                "reason": random.choice(list(self.server.PaymentReason)).value,
+                "cost_center": random.choice(COST_CENTERS),
+                "payment_method": random.choice(["cash", "check"]),
+                "payment_method_other": None,
+                "account_number": str(random.randint(10 ** 11, 10 ** 12 - 1)),
+                "bank_name": random.choice(BANKS),
+                "account_holder_name": random.choice(SUPPLIERS),
+                "payment_date": None,
+                "notes": None,
+            },
+            "attachment_base64": self.blobs.pick(),
+            "invoice_base64": None,
+            "status": Status.DRAFT.value,
+            "history": [{"action": "created", "actor_id": requester['id'], "actor_name": requester['full_name'],
+                         "timestamp": created, "notes": None}],
+            "created_at": created,
+            "updated_at": created,
+        }
+
+        def step(action, to_status, actor, notes=None):
+            timestamp = next(stamps)
+            doc['history'].append({"action": action, **actor, "timestamp": timestamp, "notes": notes})
+            doc['status'] = to_status.value
+            doc['updated_at'] = timestamp
+            return timestamp
+
+        if target == "draft":
+            return doc
+        step("submitted", Status.PENDING_FINANCIAL, {"actor_id": requester['id'], "actor_name": requester['full_name']})
+        if target == "pending_financial":
+            return doc
+        step("reviewed_by_financial", Status.PENDING_DEV_MANAGER, self._actor("financial"))
+        if target == "pending_dev_manager":
+            return doc
+        if target == "rejected":
+            # رد مالی درخواست را به پیش‌نویس برمی‌گرداند؛ فقط مدیر توسعه آن را رد نهایی می‌کند
+            step("rejected_by_dev_manager", Status.REJECTED, self._actor("dev_manager"), "مدارک ناقص است")
+            return doc
+        step("approved_by_dev_manager", Status.PENDING_PAYMENT, self._actor("dev_manager"))
+        if target == "pending_payment":
+            return doc
+        paid_at = step("completed", Status.COMPLETED, self._actor("financial"))
+        doc['payment_row']['payment_date'] = format_jalali(paid_at.astimezone(self.server.REPORT_TIMEZONE).date())
+        doc['invoice_base64'] = self.blobs.pick()
+        return doc
+
+    # ---------- پیشنهاد پروژه ----------
+    def proposal(self) -> Dict[str, Any]:
+        Status, Action = self.server.ProposalStatus, self.server.ProposalActionType
+        proposer = random.choice(self.requesters)
+        proposer_actor = {"actor_id": proposer['id'], "actor_name": proposer['full_name']}
+        target = _pick(PROPOSAL_WEIGHTS)
+        created = self._created_at()
+        stamps = iter(_timeline(created, 4, self.now))
+        blob = self.blobs.pick()
+
+        doc = {
+            "id": str(uuid.uuid4()),
+            "proposal_number": None,
+            "project_code": None,
+            "proposer_id": proposer['id'],
+            "proposer_name": proposer['full_name'],
+            "title": f"{random.choice(PROPOSAL_TITLES)} {random.choice(COST_CENTERS)}",
+            "objective": random.choice(PROPOSAL_OBJECTIVES),
+            "project_type": random.choice(list(self.server.ProjectType)).value,
+            "description": random.choice(DESCRIPTIONS),
+            "documents": [blob] if blob else [],
+            "is_aligned": None, "coo_notes": None, "coo_reviewed_at": None,
+            "feasibility_manager_id": None, "feasibility_manager_name": None,
+            "dev_manager_notes": None, "dev_manager_assigned_at": None,
+            "project_start_date": None, "control_notes": None, "registered_at": None,
+            "status": Status.DRAFT.value,
+            "history": [],
+            "created_at": created,
+            "updated_at": created,
+        }
+
+        def step(action, to_status, actor, timestamp, notes=None):
+            doc['history'].append({
+                "action": action.value, **actor, "timestamp": timestamp, "notes": notes,
+                "from_status": doc['status'] if doc['history'] else None, "to_status": to_status.value,
+            })
+            doc['status'] = to_status.value
+            doc['updated_at'] = timestamp
+            return timestamp
+
+        step(Action.CREATED, Status.DRAFT, proposer_actor, created)
+        if target == "draft":
+            return doc
+        step(Action.SUBMITTED, Status.PENDING_COO, proposer_actor, next(stamps))
+        if target == "pending_coo":
+            return doc
+        if target == "rejected_by_coo":
+            doc.update(is_aligned=False, coo_reviewed_at=step(
+                Action.REJECTED_BY_COO, Status.REJECTED_BY_COO, self._actor("coo"), next(stamps), "هم‌راستا با اهداف نیست"))
+            return doc
+        doc.update(is_aligned=True, coo_reviewed_at=step(
+            Action.APPROVED_BY_COO, Status.PENDING_DEV_MANAGER, self._actor("coo"), next(stamps)))
+        if target == "pending_dev_manager":
+            return doc
+        manager = self.staff["dev_manager"]
+        doc.update(feasibility_manager_id=manager['id'], feasibility_manager_name=manager['full_name'],
+                   dev_manager_assigned_at=step(Action.ASSIGNED_FEASIBILITY_MANAGER, Status.PENDING_PROJECT_CONTROL,
+                                                self._actor("dev_manager"), next(stamps)))
+        if target == "pending_project_control":
+            return doc
+        registered_at = next(stamps)
+        project_code = f"P{self._jalali_year(registered_at)}-{random.randint(100, 999)}"
+        step(Action.REGISTERED_PROJECT, Status.COMPLETED, self._actor("project_control"), registered_at,
+             f"کد پروژه: {project_code}")
+        doc.update(project_code=project_code, registered_at=registered_at,
+                   project_start_date=registered_at + timedelta(days=random.randint(7, 60)))
+        return doc
+
+
+async def reserve_counter(db, query: Dict[str, Any], count: int) -> int:
+    # اولین شماره یک بازه پیوسته؛ مانند reserve_request_numbers در برنامه
+    counter_doc = await db.counters.find_one_and_update(
+        query, {"$inc": {"counter": count}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter_doc['counter'] - count + 1
+
+
+# نوع -> (مجموعه، شمارنده، قالب شماره، فیلد شماره)
+KINDS = {
+    "goods": ("goods_requests", "request_number", "{year}-{n}", "request_number"),
+    "payment": ("payment_requests", "payment_number", "PAY-{year}-{n}", "request_number"),
+    "proposal": ("project_proposals", "proposal_number", "PP-{year}-{n}", "proposal_number"),
+}
+
+
+async def _number(generator: Generator, kind: str, docs: List[dict]):
+    db = generator.server.db
+    _, counter, template, field = KINDS[kind]
+    by_year = defaultdict(list)
+    for doc in docs:
+        by_year[generator._jalali_year(doc['created_at'])].append(doc)
+    for year, year_docs in by_year.items():
+        # شماره‌ها به ترتیب زمان ایجاد داده می‌شوند
+        year_docs.sort(key=lambda doc: doc['created_at'])
+        first = await reserve_counter(db, {"type": counter, "year": year}, len(year_docs))
+        for n, doc in enumerate(year_docs, start=first):
+            doc[field] = template.format(year=year, n=n)
+
+    receipts = [receipt for doc in docs for receipt in doc.get('receipts', [])]
+    if receipts:
+        first = await reserve_counter(db, {"type": "receipt_number"}, len(receipts))
+        for n, receipt in enumerate(receipts, start=first):
+            receipt['receipt_number'] = f"R-{n:05d}"
+
+    first = await generator.server.reserve_revisions(len(docs))
+    for offset, doc in enumerate(docs):
+        doc['revision'] = first + offset
+
+
+async def generate(server, generator: Generator, counts: Dict[str, int], batch_size: int = 1000, parallel: int = 4,
+                   progress: bool = False) -> Dict[str, int]:
+    # ساخت اسناد روی حلقه رویداد انجام می‌شود و درج‌ها به صورت همزمان در thread pool موتور اجرا می‌شوند
+    semaphore = asyncio.Semaphore(parallel)
+    tasks = []
+    inserted = defaultdict(int)
+    started = time.perf_counter()
+
+    async def insert(kind: str, docs: List[dict]):
+        collection = KINDS[kind][0]
+        try:
+            await server.db[collection].insert_many(docs, ordered=False)
+            await server.db.search_index.insert_many([
+                {"kind": kind, "entity_id": doc['id'], **server._search_entry(kind, doc)} for doc in docs
+            ], ordered=False)
+            if kind == "goods":
+                observations = [obs for doc in docs for obs in request_observations(doc)]
+                if observations:
+                    await server.db.price_observations.insert_many(observations, ordered=False)
+            inserted[kind] += len(docs)
+            if progress:
+                total = sum(inserted.values())
+                elapsed = time.perf_counter() - started
+                print(f"\r{total} documents, {total / elapsed:.0f} docs/s", end="", file=sys.stderr, flush=True)
+        finally:
+            semaphore.release()
+
+    for kind, count in counts.items():
+        build = getattr(generator, kind)
+        for start in range(0, count, batch_size):
+            docs = [build() for _ in range(min(batch_size, count - start))]
+            await _number(generator, kind, docs)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(insert(kind, docs)))
+            # اجازه شروع درج پیش از ساخت دسته بعدی
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*tasks)
+    if progress:
+        print(file=sys.stderr)
+    for kind in counts:
+        await server.bump_collection_revision(KINDS[kind][0])
+    return dict(inserted)
+
+
+async def load_users(server):
+    users = await server.db.users.find({}, {"_id": 0, "id": 1, "username": 1, "full_name": 1, "roles": 1}).to_list(None)
+    staff = {}
+    for username, roles in ROLE_USERS.items():
+        user = next(user for user in users if user['username'] == username)
+        staff[roles[0]] = user
+    requester_users = [user for user in users if "requester" in user.get('roles', [])]
+    return requester_users, staff
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate synthetic procurement data")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "procurement_bench"))
+    parser.add_argument("--goods", type=int, default=100000)
+    parser.add_argument("--payments", type=int, default=20000)
+    parser.add_argument("--proposals", type=int, default=2000)
+    parser.add_argument("--requesters", type=int, default=200)
+    parser.add_argument("--blob-kb", type=int, default=50, help="size of each attachment")
+    parser.add_argument("--days", type=int, default=730, help="spread created_at over this many days")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--parallel", type=int, default=4, help="concurrent insert_many batches")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible data")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    await server.ensure_indexes()
+    await seed_users(server, args.requesters)
+    requesters, staff = await load_users(server)
+    generator = Generator(server, requesters, staff, args.blob_kb, args.days)
+    started = time.perf_counter()
+    inserted = await generate(
+        server, generator, {"goods": args.goods, "payment": args.payments, "proposal": args.proposals},
+        batch_size=args.batch_size, parallel=args.parallel, progress=True,
+    )
+    elapsed = time.perf_counter() - started
+    print(", ".join(f"{kind}: {count}" for kind, count in inserted.items()) + f" in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+# اجرای سناریوهای سنجش کارایی روی یک پایگاه داده محلی
+#
+#   cd backend && python -m benchmarks.run                       اجرای درون‌فرایندی با ASGI
+#   python -m benchmarks.run --workers 4                         اجرا روی uvicorn با چند worker
+#   python -m benchmarks.run --url http://localhost:8001         اجرا روی سرور در حال اجرا
+#   python -m benchmarks.run --save-baseline                     ذخیره نتیجه به عنوان baseline
+#
+# نتیجه هر endpoint (تعداد، خطا، توان عملیاتی و p50/p95/p99) با baseline ذخیره‌شده مقایسه می‌شود
+# و در صورت پسرفت p95 بیش از آستانه، خروجی با کد ۱ پایان می‌یابد.
+# پایگاه داده پیش‌فرض procurement_bench است؛ هرگز روی پایگاه داده اصلی اجرا نکنید.
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backend benchmark and load test")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "procurement_bench"))
+    parser.add_argument("--url", help="benchmark an already running server instead of the in-process app")
+    parser.add_argument("--workers", type=int, default=0, help="start uvicorn with this many workers")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=20, help="runs of each scenario")
+    parser.add_argument("--scenarios", default="goods,payment,proposal,read")
+    parser.add_argument("--requesters", type=int, default=20)
+    parser.add_argument("--seed-goods", type=int, default=5000)
+    parser.add_argument("--seed-payments", type=int, default=2000)
+    parser.add_argument("--seed-proposals", type=int, default=500)
+    parser.add_argument("--attachment-kb", type=int, default=200)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95 regression")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+            try:
+                if (await client.get("/openapi.json")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("uvicorn did not start in time")
+
+
+async def login(client: httpx.AsyncClient, usernames, password: str):
+    tokens = {}
+    for username in usernames:
+        response = await client.post("/api/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        tokens[username] = response.json()['token']
+    return tokens
+
+
+async def run_scenarios(client: httpx.AsyncClient, args, tokens, requesters):
+    from benchmarks.scenarios import SCENARIOS, Session
+    from benchmarks.stats import BenchmarkError, Recorder
+
+    recorder = Recorder()
+    session = Session(client, recorder, tokens, requesters, args.attachment_kb)
+    jobs = [SCENARIOS[name] for name in args.scenarios.split(",") for _ in range(args.iterations)]
+    random.shuffle(jobs)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failures = []
+
+    async def run(job):
+        async with semaphore:
+            try:
+                await job(session)
+            except BenchmarkError as e:
+                failures.append(str(e))
+
+    await asyncio.gather(*(run(job) for job in jobs))
+    recorder.stop()
+    for failure in failures[:10]:
+        print(f"failed: {failure}", file=sys.stderr)
+    return recorder.report()
+
+
+async def main():
+    args = parse_args()
+    unknown = set(args.scenarios.split(",")) - {"goods", "payment", "proposal", "read"}
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # تنظیمات پیش از import سرور اعمال می‌شوند
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    from benchmarks.generate import Generator, generate, load_users
+    from benchmarks.seed import PASSWORD, requester_names, seed_users
+    from benchmarks.stats import compare, format_report, load_baseline, save_baseline
+
+    for handler in server.app.router.on_startup:
+        await handler()
+    process = None
+    try:
+        users = await seed_users(server, args.requesters)
+        if not args.skip_seed:
+            started = time.perf_counter()
+            requesters, staff = await load_users(server)
+            generator = Generator(server, requesters, staff, args.attachment_kb, days=365)
+            await generate(server, generator, {
+                "goods": args.seed_goods, "payment": args.seed_payments, "proposal": args.seed_proposals,
+            })
+            print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=120)
+        elif args.workers:
+            port = free_port()
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", str(args.workers)],
+                cwd=BACKEND_DIR, env=os.environ.copy(),
+            )
+            await wait_until_ready(f"http://127.0.0.1:{port}", process)
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120)
+        else:
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench", timeout=120)
+
+        async with client:
+            tokens = await login(client, users, PASSWORD)
+            report = await run_scenarios(client, args, tokens, requester_names(args.requesters))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        for handler in server.app.router.on_shutdown:
+            await handler()
+
+    baseline = load_baseline(args.baseline)
+    print(format_report(report, baseline))
+    if args.save_baseline:
+        save_baseline(args.baseline, report)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if baseline:
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\nregressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
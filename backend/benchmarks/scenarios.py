@@ -0,0 +1,131 @@
+# سناریوهای کامل گردش کار که به صورت همزمان اجرا می‌شوند
+import base64
+import os
+import random
+from typing import Dict, List, Optional
+
+from benchmarks.stats import Recorder
+
+ITEM_NAMES = ["لپ‌تاپ", "میز اداری", "صندلی گردان", "کاغذ A4", "کارتریج چاپگر", "مانیتور ۲۴ اینچ", "کابل شبکه"]
+
+
+def attachment(size_kb: int) -> Optional[str]:
+    return base64.b64encode(os.urandom(size_kb * 1024)).decode() if size_kb else None
+
+
+class Session:
+    # توکن هر نقش و کاربران متقاضی
+    def __init__(self, client, recorder: Recorder, tokens: Dict[str, str], requesters: List[str], attachment_kb: int):
+        self.client = client
+        self.recorder = recorder
+        self.tokens = tokens
+        self.requesters = requesters
+        self.attachment_kb = attachment_kb
+
+    def headers(self, user: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.tokens[user]}"}
+
+    async def post(self, name: str, path: str, user: str, body=None):
+        response = await self.recorder.call(name, self.client.post(path, json=body, headers=self.headers(user)))
+        return response.json()
+
+    async def get(self, name: str, path: str, user: str):
+        response = await self.recorder.call(name, self.client.get(path, headers=self.headers(user)))
+        return response.json()
+
+
+async def goods_workflow(session: Session):
+    requester = random.choice(session.requesters)
+    created = await session.post("POST /goods-requests", "/api/goods-requests", requester, {
+        "item_name": random.choice(ITEM_NAMES),
+        "quantity": random.randint(1, 20),
+        "cost_center": "دفتر",
+        "description": "درخواست آزمایشی برای سنجش کارایی",
+        "image_base64": attachment(session.attachment_kb),
+    })
+    request_id = created['request_id']
+    path = f"/api/goods-requests/{request_id}"
+
+    await session.post("POST /goods-requests/{id}/submit", f"{path}/submit", requester)
+    await session.post("POST /goods-requests/{id}/inquiries", f"{path}/inquiries", "procurement", [
+        {"unit_price": price, "quantity": 1, "total_price": price, "image_base64": attachment(session.attachment_kb)}
+        for price in random.sample(range(1_000_000, 9_000_000, 10_000), 3)
+    ])
+    detail = await session.get("GET /goods-requests/{id}", path, "management")
+    await session.post("POST /goods-requests/{id}/select-inquiry", f"{path}/select-inquiry", "management", {
+        "inquiry_id": detail['inquiries'][0]['id'],
+        "action": "approve",
+    })
+    await session.post("POST /goods-requests/{id}/receipts", f"{path}/receipts", "procurement", {
+        "quantity": 1, "unit_price": 1_000_000, "total_price": 1_000_000,
+    })
+    detail = await session.get("GET /goods-requests/{id}", path, requester)
+    confirm = {"receipt_id": detail['receipts'][0]['id'], "receipt_date": "1404/05/01", "receipt_time": "10:30"}
+    await session.post("POST /goods-requests/{id}/receipts/confirm-procurement",
+                       f"{path}/receipts/confirm-procurement", "procurement", confirm)
+    await session.post("POST /goods-requests/{id}/receipts/confirm-requester",
+                       f"{path}/receipts/confirm-requester", requester, confirm)
+    await session.post("POST /goods-requests/{id}/invoice", f"{path}/invoice", "procurement", {
+        "invoice_base64": attachment(session.attachment_kb) or "",
+    })
+    await session.post("POST /goods-requests/{id}/approve-financial", f"{path}/approve-financial", "financial", {})
+
+
+async def payment_workflow(session: Session):
+    requester = random.choice(session.requesters)
+    created = await session.post("POST /payment-requests", "/api/payment-requests", requester, {
+        "request_type": "purchase",
+        "total_amount": 25_000_000,
+        "payment_row": {
+            "amount": 25_000_000,
+            "reason": "prepayment",
+            "cost_center": "دفتر",
+            "payment_method": "cash",
+            "bank_name": "بانک ملت",
+            "account_holder_name": "شرکت نمونه",
+        },
+        "attachment_base64": attachment(session.attachment_kb),
+    })
+    path = f"/api/payment-requests/{created['request_id']}"
+    await session.post("POST /payment-requests/{id}/submit", f"{path}/submit", requester)
+    await session.post("POST /payment-requests/{id}/review-financial", f"{path}/review-financial", "financial", {})
+    await session.post("POST /payment-requests/{id}/approve-dev-manager", f"{path}/approve-dev-manager", "dev_manager", {})
+    await session.post("POST /payment-requests/{id}/process-payment", f"{path}/process-payment", "financial", {
+        "payment_date": "1404/05/10",
+    })
+
+
+async def proposal_workflow(session: Session):
+    proposer = random.choice(session.requesters)
+    created = await session.post("POST /project-proposals", "/api/project-proposals", proposer, {
+        "title": "طرح توسعه خط تولید",
+        "objective": "افزایش ظرفیت تولید",
+        "project_type": "industrial",
+    })
+    path = f"/api/project-proposals/{created['proposal_id']}"
+    await session.post("POST /project-proposals/{id}/submit", f"{path}/submit", proposer)
+    await session.post("POST /project-proposals/{id}/coo-review", f"{path}/coo-review", "coo", {"is_aligned": True})
+    await session.post("POST /project-proposals/{id}/assign-manager", f"{path}/assign-manager", "dev_manager", {
+        "feasibility_manager_id": "bench", "feasibility_manager_name": "مدیر امکان‌سنجی",
+    })
+    await session.post("POST /project-proposals/{id}/register", f"{path}/register", "project_control", {
+        "project_code": f"P-{random.randint(1000, 9999)}", "project_start_date": "2025-08-01",
+    })
+
+
+async def read_mix(session: Session):
+    requester = random.choice(session.requesters)
+    await session.get("GET /goods-requests", "/api/goods-requests", requester)
+    await session.get("GET /payment-requests", "/api/payment-requests", requester)
+    await session.get("GET /inbox", "/api/inbox", "procurement")
+    await session.get("GET /notifications", "/api/notifications", requester)
+    await session.get("GET /goods-requests?from=1404/05", "/api/goods-requests?from=1404/05", "management")
+    await session.get("GET /search", f"/api/search?q={random.choice(ITEM_NAMES)}", "procurement")
+
+
+SCENARIOS = {
+    "goods": goods_workflow,
+    "payment": payment_workflow,
+    "proposal": proposal_workflow,
+    "read": read_mix,
+}
@@ -0,0 +1,36 @@
+# کاربران نقش‌های مختلف برای سنجش کارایی و تولید داده مصنوعی
+from typing import Dict, List
+
+PASSWORD = "bench-pass"
+
+# نام کاربری -> نقش‌ها؛ متقاضیان جداگانه ساخته می‌شوند
+ROLE_USERS = {
+    "bench_admin": ["admin"],
+    "procurement": ["procurement"],
+    "management": ["management"],
+    "financial": ["financial"],
+    "dev_manager": ["dev_manager"],
+    "coo": ["coo"],
+    "project_control": ["project_control"],
+}
+
+
+def requester_names(count: int) -> List[str]:
+    return [f"requester{i:03d}" for i in range(1, count + 1)]
+
+
+async def seed_users(server, requesters: int) -> Dict[str, dict]:
+    # هش bcrypt کند است؛ یک هش برای همه کاربران کافی است
+    password_hash = server.hash_password(PASSWORD)
+    users = {name: roles for name, roles in ROLE_USERS.items()}
+    users.update({name: ["requester"] for name in requester_names(requesters)})
+
+    existing = {doc['username'] async for doc in server.db.users.find({"username": {"$in": list(users)}}, {"username": 1})}
+    docs = [
+        server.User(username=name, full_name=f"کاربر {name}", password_hash=password_hash, roles=roles).model_dump()
+        for name, roles in users.items() if name not in existing
+    ]
+    if docs:
+        await server.db.users.insert_many(docs)
+        await server.bump_collection_revision("users")
+    return users
@@ -0,0 +1,110 @@
+# جمع‌آوری زمان پاسخ هر endpoint و مقایسه با baseline ذخیره‌شده
+import json
+import math
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # روش nearest-rank
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    async def call(self, name: str, request, expected=(200,)):
+        started = time.perf_counter()
+        response = await request
+        self.samples[name].append((time.perf_counter() - started) * 1000)
+        if response.status_code not in expected:
+            self.errors[name] += 1
+            raise BenchmarkError(f"{name} -> {response.status_code}: {response.text[:200]}")
+        return response
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        result = {}
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            result[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(values[-1], 2),
+            }
+        total = sum(len(values) for values in self.samples.values())
+        result["_total"] = {
+            "count": total,
+            "errors": sum(self.errors.values()),
+            "rps": round(total / elapsed, 2) if elapsed else 0.0,
+            "elapsed_s": round(elapsed, 2),
+        }
+        return result
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def format_report(report: Dict[str, Dict[str, float]], baseline: Optional[Dict] = None) -> str:
+    header = f"{'endpoint':<58} {'count':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline:
+        header += f" {'p95 base':>9} {'delta':>7}"
+    lines = [header, "-" * len(header)]
+    for name, row in report.items():
+        if name.startswith("_"):
+            continue
+        line = (
+            f"{name:<58} {row['count']:>6} {row['errors']:>4} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}"
+        )
+        base = (baseline or {}).get(name)
+        if base:
+            delta = (row['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+            line += f" {base['p95_ms']:>9.1f} {delta:>+6.0f}%"
+        lines.append(line)
+    total = report.get("_total", {})
+    lines.append("-" * len(header))
+    lines.append(f"total: {total.get('count', 0)} requests, {total.get('errors', 0)} errors, "
+                 f"{total.get('rps', 0)} req/s over {total.get('elapsed_s', 0)}s")
+    return "\n".join(lines)
+
+
+def compare(report: Dict, baseline: Dict, threshold: float, min_delta_ms: float = 5.0) -> List[str]:
+    # افزایش p95 بیش از threshold (نسبی) و min_delta_ms (مطلق) پسرفت حساب می‌شود
+    regressions = []
+    for name, row in report.items():
+        base = baseline.get(name)
+        if name.startswith("_") or not base:
+            continue
+        limit = base['p95_ms'] * (1 + threshold)
+        if row['p95_ms'] > limit and row['p95_ms'] - base['p95_ms'] >= min_delta_ms:
+            regressions.append(f"{name}: p95 {row['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+    return regressions
+
+
+def load_baseline(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_baseline(path: Path, report: Dict):
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
@@ -0,0 +1,189 @@
+# فشرده‌سازی پاسخ‌ها با gzip/brotli بر اساس Accept-Encoding و آستانه حجم
+import gzip
+import zlib
+from typing import Dict, Optional, Sequence, Tuple
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli اختیاری است؛ بدون آن فقط gzip ارائه می‌شود
+    brotli = None
+
+# انواعی که خودشان فشرده هستند (xlsx و docx در واقع zip هستند)
+EXCLUDED_CONTENT_TYPES = (
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument",
+    "image/",
+    "video/",
+    "audio/",
+)
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    # بالاترین q؛ در صورت برابری br بر gzip مقدم است
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Encoder:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.flush
+            self._finish = self._compressor.finish
+        else:
+            # wbits=31 یعنی قالب gzip
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = lambda: self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._compressor.flush
+
+    def chunk(self, data: bytes) -> bytes:
+        # در پاسخ‌های جریانی هر قطعه بلافاصله flush می‌شود تا کلاینت منتظر نماند
+        return self._compress(data) + self._flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compress(data) + self._finish()
+
+
+class CompressionMiddleware:
+    # میان‌افزار ASGI خام؛ پاسخ‌های جریانی (خروجی CSV/NDJSON) هم قطعه‌به‌قطعه فشرده می‌شوند
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        excluded_content_types: Sequence[str] = EXCLUDED_CONTENT_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_content_types = tuple(excluded_content_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), None)
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+        # قطعه‌های کوچک ابتدایی تا رسیدن به آستانه نگه داشته می‌شوند (BaseHTTPMiddleware بدنه را قطعه‌قطعه می‌فرستد)
+        pending = b""
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough, pending
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+                passthrough = (
+                    b"content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or content_type.startswith(self.excluded_content_types)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                pending += body
+                if more_body and len(pending) < self.minimum_size:
+                    return
+                body, pending = pending, b""
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+                    return
+                encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+                if not more_body:
+                    data = encoder.finish(body)
+                    await send(self._compressed_start(start_message, encoding, len(data)))
+                    await send({"type": "http.response.body", "body": data, "more_body": False})
+                    return
+                await send(self._compressed_start(start_message, encoding))
+
+            data = encoder.chunk(body) if more_body else encoder.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressed_start(message, encoding: str, content_length: Optional[int] = None):
+        headers = [
+            (name, value) for name, value in message.get("headers", [])
+            if name.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [value for name, value in message.get("headers", []) if name.lower() == b"vary"]
+        vary_values = {v.strip().lower() for value in vary for v in value.split(b",")}
+        vary_values.add(b"accept-encoding")
+        headers.append((b"vary", b", ".join(sorted(vary_values))))
+        headers.append((b"content-encoding", encoding.encode()))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**message, "headers": headers}
+
+
+class CompressedArtifact:
+    # محصول ثابتی که یک بار فشرده و نگه داشته می‌شود تا در هر دانلود دوباره فشرده نشود
+    __slots__ = ("media_type", "encoded", "size")
+
+    def __init__(self, content: bytes, media_type: str, gzip_level: int = 9, brotli_quality: int = 9):
+        self.media_type = media_type
+        self.size = len(content)
+        self.encoded: Dict[str, bytes] = {"gzip": gzip.compress(content, compresslevel=gzip_level, mtime=0)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(content, quality=brotli_quality)
+
+    def content(self) -> bytes:
+        return gzip.decompress(self.encoded["gzip"])
+
+    def response(self, accept_encoding: Optional[str], headers: Optional[Dict[str, str]] = None) -> Response:
+        headers = dict(headers or {})
+        headers["Vary"] = "Accept-Encoding"
+        encoding = choose_encoding(accept_encoding)
+        if encoding in self.encoded:
+            headers["Content-Encoding"] = encoding
+            return Response(content=self.encoded[encoding], media_type=self.media_type, headers=headers)
+        return Response(content=self.content(), media_type=self.media_type, headers=headers)
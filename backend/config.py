@@ -0,0 +1,83 @@
+# تنظیمات اتصال MongoDB (اندازه pool، زمان‌های انتظار، فشرده‌سازی و read preference) از .env
+import importlib.util
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+logger = logging.getLogger(__name__)
+
+# فشرده‌سازی -> ماژول پایتونی مورد نیاز (zlib همیشه در دسترس است)
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+# نام متغیر محیطی -> (گزینه pymongo، مقدار پیش‌فرض)؛ None یعنی پیش‌فرض خود درایور
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", 100),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", 5),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", 300000),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", 10000),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", 5000),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", 10000),
+    # خروجی‌های طولانی هر batch را جداگانه می‌خوانند، پس محدودیت socket به ازای هر فرمان است
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", None),
+}
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name, "").strip()
+    return int(value) if value else default
+
+
+def compressors() -> Optional[str]:
+    # فقط فشرده‌سازهایی که ماژول آن‌ها نصب است؛ سرور اولین مورد مشترک را انتخاب می‌کند
+    requested = [name.strip() for name in os.environ.get('MONGO_COMPRESSORS', 'zstd,snappy,zlib').split(",") if name.strip()]
+    available = []
+    for name in requested:
+        if name not in COMPRESSOR_MODULES:
+            logger.warning("Unknown MongoDB compressor %s ignored", name)
+        elif COMPRESSOR_MODULES[name] and importlib.util.find_spec(COMPRESSOR_MODULES[name]) is None:
+            logger.info("MongoDB compressor %s skipped: %s is not installed", name, COMPRESSOR_MODULES[name])
+        else:
+            available.append(name)
+    return ",".join(available) or None
+
+
+def mongo_client_options() -> Dict[str, Any]:
+    options = {}
+    for env_name, (option, default) in CLIENT_OPTIONS.items():
+        value = _env_int(env_name, default)
+        if value is not None:
+            options[option] = value
+    enabled = compressors()
+    if enabled:
+        options["compressors"] = enabled
+    return options
+
+
+def reporting_read_preference():
+    # گزارش‌ها، خروجی‌ها و آمار؛ روی سرور تکی secondaryPreferred همان primary است
+    mode = os.environ.get('MONGO_REPORTING_READ_PREFERENCE', 'secondaryPreferred')
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Invalid MONGO_REPORTING_READ_PREFERENCE: {mode}")
+    if mode == "primary":
+        return Primary()
+    # حداقل مقدار مجاز در درایور ۹۰ ثانیه است
+    return READ_PREFERENCES[mode](max_staleness=_env_int('MONGO_REPORTING_MAX_STALENESS_SECONDS', 90))
+
+
+def reporting_lag() -> timedelta:
+    # حداکثر عقب‌ماندگی داده خوانده‌شده از secondary؛ واترمارک خروجی افزایشی به همین اندازه عقب می‌رود
+    preference = reporting_read_preference()
+    if isinstance(preference, Primary):
+        return timedelta(0)
+    return timedelta(seconds=max(preference.max_staleness, 0))
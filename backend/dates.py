@@ -0,0 +1,64 @@
+# تاریخ‌ها به صورت Date بومی MongoDB ذخیره می‌شوند؛ اسناد قدیمی رشته ISO دارند
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# فیلدهایی که زمان ثبت را نگه می‌دارند؛ تاریخ‌های انتخابی کاربر (مثل payment_date) رشته باقی می‌مانند
+DATE_FIELD_NAMES = ("timestamp",)
+DATE_FIELD_SUFFIX = "_at"
+
+
+def is_date_field(name: str) -> bool:
+    return name in DATE_FIELD_NAMES or name.endswith(DATE_FIELD_SUFFIX)
+
+
+def as_datetime(value: Any) -> Optional[datetime]:
+    # خواننده سازگار: هم Date بومی و هم رشته ISO قدیمی را می‌پذیرد
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def date_range(field: str, **bounds: Optional[datetime]) -> Dict[str, Any]:
+    # تا پایان مهاجرت، شرط بازه روی هر دو شکل ذخیره‌شده اعمال می‌شود
+    # مثال: date_range("updated_at", gte=since, lt=until)
+    native = {}
+    legacy = {"$type": "string"}
+    for op, value in bounds.items():
+        if value is None:
+            continue
+        value = as_datetime(value).astimezone(timezone.utc)
+        native[f"${op}"] = value
+        legacy[f"${op}"] = value.isoformat()
+    if not native:
+        return {}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+def string_dates(doc: Any, prefix: str = "") -> Iterator[Tuple[str, str, datetime]]:
+    # مسیر نقطه‌دار، مقدار رشته‌ای فعلی و مقدار تبدیل‌شده هر فیلد تاریخ قدیمی
+    if isinstance(doc, dict):
+        for key, value in doc.items():
+            if key == "_id":
+                continue
+            path = f"{prefix}{key}"
+            if isinstance(value, str) and is_date_field(key):
+                try:
+                    yield path, value, as_datetime(value)
+                except ValueError:
+                    continue
+            elif isinstance(value, (dict, list)):
+                yield from string_dates(value, f"{path}.")
+    elif isinstance(doc, list):
+        for index, item in enumerate(doc):
+            yield from string_dates(item, f"{prefix}{index}.")
+
+
+def merge_filter(query: Dict[str, Any], clause: Dict[str, Any]) -> Dict[str, Any]:
+    # دو شرط $or نباید روی هم نوشته شوند
+    if not clause:
+        return query
+    if "$or" in query and "$or" in clause:
+        return {"$and": [query, clause]}
+    return {**query, **clause}
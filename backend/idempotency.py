@@ -0,0 +1,128 @@
+# پاسخ اولین درخواست با هدر Idempotency-Key ذخیره و در تلاش‌های مجدد همان پاسخ برگردانده می‌شود
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Optional
+
+from pymongo.errors import DuplicateKeyError
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    def __init__(
+        self,
+        app,
+        collection,
+        identify: Callable[[Request], Optional[str]],
+        ttl: timedelta,
+        lock_timeout: timedelta = timedelta(minutes=2),
+        methods: Iterable[str] = ("POST", "PUT", "PATCH"),
+        path_prefix: str = "/api",
+        max_body_size: int = 1024 * 1024,
+    ):
+        super().__init__(app)
+        self.collection = collection
+        self.identify = identify
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.methods = set(methods)
+        self.path_prefix = path_prefix
+        self.max_body_size = max_body_size
+
+    async def dispatch(self, request: Request, call_next):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or request.method not in self.methods or not request.url.path.startswith(self.path_prefix):
+            return await call_next(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)
+
+        user_id = self.identify(request)
+        if not user_id:
+            # درخواست بدون توکن معتبر در خود endpoint رد می‌شود
+            return await call_next(request)
+
+        # کلید برای هر کاربر، متد و مسیر جداگانه است
+        scope = f"{user_id}\n{request.method}\n{request.url.path}\n{key}"
+        record_id = hashlib.sha256(scope.encode('utf-8')).hexdigest()
+        fingerprint = hashlib.sha256(await request.body()).hexdigest()
+
+        existing = await self._claim(record_id, fingerprint)
+        if existing is not None:
+            return self._replay(existing, fingerprint)
+
+        try:
+            response = await call_next(request)
+        except Exception:
+            await self.collection.delete_one({"_id": record_id, "state": "in_progress"})
+            raise
+
+        if response.status_code >= 500:
+            # خطای سرور ذخیره نمی‌شود تا تلاش مجدد واقعا اجرا شود
+            await self.collection.delete_one({"_id": record_id, "state": "in_progress"})
+            return response
+
+        body = b""
+        async for chunk in response.body_iterator:
+            body += chunk
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in ("content-length", "set-cookie")
+        }
+        if len(body) <= self.max_body_size:
+            await self.collection.update_one(
+                {"_id": record_id},
+                {"$set": {
+                    "state": "completed",
+                    "status_code": response.status_code,
+                    "headers": headers,
+                    "body": body,
+                    "expires_at": datetime.now(timezone.utc) + self.ttl
+                }}
+            )
+        else:
+            logger.warning("Idempotent response for %s too large to store", request.url.path)
+            await self.collection.delete_one({"_id": record_id, "state": "in_progress"})
+        return Response(content=body, status_code=response.status_code, headers=headers)
+
+    async def _claim(self, record_id: str, fingerprint: str) -> Optional[dict]:
+        # None یعنی این درخواست اولین اجرا است؛ در غیر این صورت رکورد موجود برگردانده می‌شود
+        for _ in range(2):
+            now = datetime.now(timezone.utc)
+            try:
+                await self.collection.insert_one({
+                    "_id": record_id,
+                    "state": "in_progress",
+                    "fingerprint": fingerprint,
+                    "created_at": now,
+                    "expires_at": now + self.lock_timeout
+                })
+                return None
+            except DuplicateKeyError:
+                existing = await self.collection.find_one({"_id": record_id})
+            if existing is None:
+                continue
+            expires_at = existing.get('expires_at')
+            if expires_at is not None and expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            if existing.get('state') == "in_progress" and expires_at and expires_at < now:
+                # اجرای قبلی ناتمام مانده است (مثلا worker از کار افتاده)
+                await self.collection.delete_one({"_id": record_id, "state": "in_progress", "expires_at": existing['expires_at']})
+                continue
+            return existing
+        return existing
+
+    def _replay(self, record: dict, fingerprint: str) -> Response:
+        if record.get('fingerprint') != fingerprint:
+            return JSONResponse({"detail": "Idempotency-Key was used with a different request body"}, status_code=422)
+        if record.get('state') != "completed":
+            return JSONResponse({"detail": "A request with this Idempotency-Key is still in progress"}, status_code=409)
+        headers = dict(record.get('headers') or {})
+        headers['Idempotent-Replayed'] = "true"
+        return Response(content=bytes(record.get('body') or b""), status_code=record['status_code'], headers=headers)
@@ -0,0 +1,158 @@
+# تبدیل تقویم جلالی و گریگوری و محاسبه بازه‌های زمانی گزارش‌ها
+import re
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from typing import Dict, Optional, Tuple
+
+# سال‌های شکست دوره ۳۳ ساله (الگوریتم jalaali)
+_BREAKS = [
+    -61, 9, 38, 199, 426, 686, 756, 818, 1111, 1181, 1210,
+    1635, 2060, 2097, 2192, 2262, 2324, 2394, 2456, 3178
+]
+MONTH_DAYS = [31, 31, 31, 31, 31, 31, 30, 30, 30, 30, 30, 29]
+
+# بازه سال‌هایی که مرز ماه‌هایشان از قبل محاسبه می‌شود
+PRECOMPUTED_YEARS = range(1380, 1431)
+
+_PERIOD = re.compile(r"^(\d{4})(?:[/-](\d{1,2})(?:[/-](\d{1,2}))?)?$")
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+
+def _div(a: int, b: int) -> int:
+    return int(a / b)
+
+
+def _mod(a: int, b: int) -> int:
+    return a - _div(a, b) * b
+
+
+def _jal_cal(jy: int) -> Tuple[bool, date]:
+    # خروجی: کبیسه بودن سال و تاریخ گریگوری اول فروردین
+    if jy < _BREAKS[0] or jy >= _BREAKS[-1]:
+        raise ValueError(f"Jalali year out of range: {jy}")
+    gy = jy + 621
+    leap_j = -14
+    jp = _BREAKS[0]
+    jump = 0
+    for jm in _BREAKS[1:]:
+        jump = jm - jp
+        if jy < jm:
+            break
+        leap_j += _div(jump, 33) * 8 + _div(_mod(jump, 33), 4)
+        jp = jm
+    n = jy - jp
+    leap_j += _div(n, 33) * 8 + _div(_mod(n, 33) + 3, 4)
+    if _mod(jump, 33) == 4 and jump - n == 4:
+        leap_j += 1
+    leap_g = _div(gy, 4) - _div((_div(gy, 100) + 1) * 3, 4) - 150
+    march = 20 + leap_j - leap_g
+    if jump - n < 6:
+        n = n - jump + _div(jump + 4, 33) * 33
+    leap = _mod(_mod(n + 1, 33) - 1, 4)
+    if leap == -1:
+        leap = 4
+    return leap == 0, date(gy, 3, march)
+
+
+def is_leap(jy: int) -> bool:
+    return _jal_cal(jy)[0]
+
+
+def month_length(jy: int, jm: int) -> int:
+    if jm == 12 and is_leap(jy):
+        return 30
+    return MONTH_DAYS[jm - 1]
+
+
+def _compute_month_start(jy: int, jm: int) -> date:
+    _, nowruz = _jal_cal(jy)
+    return nowruz + timedelta(days=sum(MONTH_DAYS[:jm - 1]))
+
+
+MONTH_STARTS: Dict[Tuple[int, int], date] = {
+    (jy, jm): _compute_month_start(jy, jm)
+    for jy in PRECOMPUTED_YEARS
+    for jm in range(1, 13)
+}
+
+
+def month_start(jy: int, jm: int) -> date:
+    if not 1 <= jm <= 12:
+        raise ValueError(f"Invalid Jalali month: {jm}")
+    start = MONTH_STARTS.get((jy, jm))
+    return start if start is not None else _compute_month_start(jy, jm)
+
+
+def to_gregorian(jy: int, jm: int, jd: int) -> date:
+    if not 1 <= jd <= month_length(jy, jm):
+        raise ValueError(f"Invalid Jalali day: {jy}/{jm}/{jd}")
+    return month_start(jy, jm) + timedelta(days=jd - 1)
+
+
+def to_jalali(value: date) -> Tuple[int, int, int]:
+    if isinstance(value, datetime):
+        value = value.date()
+    jy = value.year - 621
+    if value < month_start(jy, 1):
+        jy -= 1
+    days = (value - month_start(jy, 1)).days
+    for jm, length in enumerate(MONTH_DAYS, start=1):
+        if days < length or jm == 12:
+            return jy, jm, days + 1
+        days -= length
+    raise AssertionError("unreachable")
+
+
+def format_jalali(value: date) -> str:
+    jy, jm, jd = to_jalali(value)
+    return f"{jy:04d}/{jm:02d}/{jd:02d}"
+
+
+def _period(text: str) -> Optional[Tuple[date, date]]:
+    # «1404»، «1404/05» یا «1404/05/10» (و معادل گریگوری) به بازه [شروع، پایان) تبدیل می‌شود
+    match = _PERIOD.match(text)
+    if not match:
+        return None
+    year, month, day = (int(part) if part else None for part in match.groups())
+    jalali = year < 1700
+    # پیش از محاسبه ماه بعد بررسی می‌شود تا پیام خطا ماه واردشده را نشان دهد
+    if month is not None and not 1 <= month <= 12:
+        raise ValueError(f"Invalid {'Jalali ' if jalali else ''}month: {month}")
+    if month is None:
+        if jalali:
+            return month_start(year, 1), month_start(year + 1, 1)
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    if day is None:
+        if jalali:
+            end = month_start(year + 1, 1) if month == 12 else month_start(year, month + 1)
+            return month_start(year, month), end
+        start = date(year, month, 1)
+        return start, date(year + month // 12, month % 12 + 1, 1)
+    start = to_gregorian(year, month, day) if jalali else date(year, month, day)
+    return start, start + timedelta(days=1)
+
+
+def _local_midnight(value: date, tz: tzinfo) -> datetime:
+    return datetime.combine(value, time.min, tzinfo=tz).astimezone(timezone.utc)
+
+
+def parse_bound(text: Optional[str], end: bool, tz: tzinfo) -> Optional[datetime]:
+    # from ابتدای دوره و to انتهای دوره را برمی‌گرداند (انتها شامل نمی‌شود)؛
+    # زمان دقیق ISO همان‌طور که هست استفاده می‌شود
+    if not text:
+        return None
+    text = text.strip().translate(_DIGITS)
+    period = _period(text)
+    if period:
+        return _local_midnight(period[1] if end else period[0], tz)
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz)
+    return value.astimezone(timezone.utc)
+
+
+def date_window(date_from: Optional[str], date_to: Optional[str], tz: tzinfo) -> Tuple[Optional[datetime], Optional[datetime]]:
+    start = parse_bound(date_from, False, tz)
+    end = parse_bound(date_to, True, tz)
+    if start and end and start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end
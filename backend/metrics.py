@@ -0,0 +1,282 @@
+# اندازه‌گیری زمان پاسخ، حجم پاسخ و فراخوانی‌های MongoDB برای هر مسیر با خروجی Prometheus
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # برای هر ترکیب برچسب: شمارش هر bucket (غیرتجمعی)، مجموع و تعداد
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[Tuple, Tuple[list, float, int]]:
+        with self._lock:
+            return {labels: (list(series[0]), series[1], series[2]) for labels, series in self._series.items()}
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+ROUTE_LABELS = ("method", "route")
+REQUESTS_TOTAL = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ROUTE_LABELS + ("status",)))
+REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ROUTE_LABELS, LATENCY_BUCKETS))
+RESPONSE_SIZE = registry.register(Histogram(
+    "http_response_size_bytes", "Response body size by route template", ROUTE_LABELS, SIZE_BUCKETS))
+REQUEST_DB_COMMANDS = registry.register(Histogram(
+    "http_request_db_commands", "MongoDB commands issued per request", ROUTE_LABELS, COUNT_BUCKETS))
+REQUEST_DB_TIME = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in MongoDB commands per request", ROUTE_LABELS, DB_TIME_BUCKETS))
+MONGO_COMMAND_DURATION = registry.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection"), DB_TIME_BUCKETS))
+MONGO_COMMAND_FAILURES = registry.register(Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("command", "collection")))
+MONGO_POOL_WAIT = registry.register(Histogram(
+    "mongo_pool_wait_seconds", "Time spent waiting to check out a pooled connection", ("address",), DB_TIME_BUCKETS))
+MONGO_POOL_CHECKOUT_FAILURES = registry.register(Counter(
+    "mongo_pool_checkout_failures_total", "Connection checkouts that failed", ("address", "reason")))
+
+
+_route_templates: Dict[Any, str] = {}
+
+
+def route_template(scope) -> str:
+    # الگوی مسیر (مثل /api/goods-requests/{request_id}) تا برچسب‌ها محدود بمانند
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in _route_templates:
+        _route_templates.update({
+            route.endpoint: route.path
+            for route in getattr(scope.get("app"), "routes", [])
+            if hasattr(route, "endpoint")
+        })
+    return _route_templates.get(endpoint, "unmatched")
+
+
+class RequestStats:
+    # آمار یک درخواست؛ listener در thread اجرای Motor آن را به‌روز می‌کند
+    __slots__ = ("scope", "db_commands", "db_seconds", "_lock")
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def route(self) -> str:
+        return route_template(self.scope) if self.scope is not None else "unmatched"
+
+    def add_command(self, seconds: float):
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+
+# Motor context را به thread اجرای فرمان کپی می‌کند، پس listener درخواست جاری را می‌بیند
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections: Dict[Tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event) -> Tuple[str, str]:
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1_000_000
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_command(seconds)
+        labels = (event.command_name, collection)
+        MONGO_COMMAND_DURATION.observe(labels, seconds)
+        return labels
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc(self._finish(event))
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    # رویدادهای شروع و پایان checkout روی همان thread رخ می‌دهند؛ زمان شروع در thread-local نگه داشته می‌شود
+    def __init__(self):
+        self._local = threading.local()
+
+    def _started_at(self) -> Dict[Tuple, float]:
+        started = getattr(self._local, "started", None)
+        if started is None:
+            started = self._local.started = {}
+        return started
+
+    def _elapsed(self, address) -> Optional[float]:
+        started = self._started_at().pop(address, None)
+        return time.perf_counter() - started if started is not None else None
+
+    def connection_check_out_started(self, event):
+        self._started_at()[event.address] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        elapsed = self._elapsed(event.address)
+        if elapsed is not None:
+            MONGO_POOL_WAIT.observe(("%s:%s" % event.address,), elapsed)
+
+    def connection_check_out_failed(self, event):
+        self._elapsed(event.address)
+        MONGO_POOL_CHECKOUT_FAILURES.inc(("%s:%s" % event.address, str(event.reason)))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class MetricsMiddleware:
+    # میان‌افزار ASGI خام؛ بدنه پاسخ بافر نمی‌شود و فقط طول آن شمرده می‌شود
+    def __init__(self, app, exclude_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            labels = (scope["method"], stats.route)
+            REQUESTS_TOTAL.inc(labels + (str(status_code),))
+            REQUEST_DURATION.observe(labels, time.perf_counter() - started)
+            RESPONSE_SIZE.observe(labels, size)
+            REQUEST_DB_COMMANDS.observe(labels, stats.db_commands)
+            REQUEST_DB_TIME.observe(labels, stats.db_seconds)
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,128 @@
+# مهاجرت آنلاین تاریخ‌های رشته‌ای ISO به Date بومی MongoDB
+#
+#   python migrate_dates.py                 ادامه از آخرین نقطه ثبت‌شده
+#   python migrate_dates.py --restart       شروع دوباره از ابتدای مجموعه‌ها
+#   python migrate_dates.py --dry-run       فقط شمارش اسنادی که تبدیل می‌شوند
+#
+# پیشرفت هر مجموعه در migrations ثبت می‌شود و اجرای قطع‌شده از همان‌جا ادامه پیدا می‌کند.
+# هر به‌روزرسانی فقط وقتی اعمال می‌شود که مقدار رشته‌ای هنوز تغییر نکرده باشد،
+# پس اجرای همزمان با برنامه امن است؛ اسناد ردشده در اجرای بعدی تبدیل می‌شوند.
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from dates import string_dates
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger("migrate_dates")
+
+MIGRATION_NAME = "native-dates"
+COLLECTIONS = [
+    "goods_requests",
+    "payment_requests",
+    "project_proposals",
+    "notifications",
+    "notifications_archive",
+    "price_observations",
+    "tombstones",
+    "users",
+    "cost_centers",
+]
+# مجموعه‌های بایگانی سالانه (goods_requests_archive_1403 و ...) هنگام اجرا پیدا می‌شوند
+ARCHIVE_PATTERN = r"_archive_\d{4}$"
+
+
+async def migrate_collection(db, name: str, batch_size: int, pause: float, dry_run: bool) -> dict:
+    checkpoint_id = f"{MIGRATION_NAME}:{name}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id}) or {}
+    stats = {"scanned": 0, "converted": 0, "skipped": 0}
+    last_id = checkpoint.get('last_id')
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db[name].find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            changes = list(string_dates(doc))
+            if not changes:
+                continue
+            # شرط روی مقدار قبلی جلوی بازنویسی تغییرات همزمان را می‌گیرد
+            guard = {"_id": doc['_id']}
+            guard.update({path: old for path, old, _ in changes})
+            operations.append(UpdateOne(guard, {"$set": {path: new for path, _, new in changes}}))
+
+        stats['scanned'] += len(batch)
+        last_id = batch[-1]['_id']
+        converted = len(operations)
+        if operations and not dry_run:
+            result = await db[name].bulk_write(operations, ordered=False)
+            converted = result.modified_count
+            stats['skipped'] += len(operations) - result.matched_count
+        stats['converted'] += converted
+
+        if not dry_run:
+            await db.migrations.update_one(
+                {"_id": checkpoint_id},
+                {
+                    "$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)},
+                    "$inc": {"converted": converted}
+                },
+                upsert=True
+            )
+        if pause:
+            await asyncio.sleep(pause)
+
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"completed_at": datetime.now(timezone.utc), "skipped": stats['skipped']}},
+            upsert=True
+        )
+    return stats
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        archives = sorted(await db.list_collection_names(filter={"name": {"$regex": ARCHIVE_PATTERN}}))
+        known = COLLECTIONS + archives
+        unknown = sorted(set(args.collection or []) - set(known))
+        if unknown:
+            raise SystemExit(f"unknown collections: {', '.join(unknown)}")
+        collections = args.collection or known
+        if args.restart and not args.dry_run:
+            await db.migrations.delete_many({"_id": {"$in": [f"{MIGRATION_NAME}:{name}" for name in collections]}})
+        for name in collections:
+            stats = await migrate_collection(db, name, args.batch_size, args.pause, args.dry_run)
+            logger.info(
+                "%s: scanned=%d converted=%d skipped=%d",
+                name, stats['scanned'], stats['converted'], stats['skipped']
+            )
+            if stats['skipped']:
+                logger.warning("%s: %d documents changed during migration; run again with --restart", name, stats['skipped'])
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert ISO string timestamps to native MongoDB dates")
+    parser.add_argument("--collection", action="append", help="one of the listed collections or a *_archive_YYYY collection")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main(parser.parse_args()))
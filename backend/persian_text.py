@@ -0,0 +1,59 @@
+# یکسان‌سازی متن فارسی برای جستجو
+import re
+from typing import Iterable, Optional
+
+ZWNJ = "\u200c"
+
+_CHAR_MAP = str.maketrans({
+    "ي": "ی",
+    "ى": "ی",
+    "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه",
+    "ۀ": "ه",
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ؤ": "و",
+    # ارقام فارسی و عربی
+    "۰": "0", "۱": "1", "۲": "2", "۳": "3", "۴": "4",
+    "۵": "5", "۶": "6", "۷": "7", "۸": "8", "۹": "9",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+    # سایر فاصله‌های مجازی و کنترلی
+    "\u200d": None,
+    "\u200e": None,
+    "\u200f": None,
+    "\u0640": None,  # کشیده
+})
+
+# اعراب و تنوین
+_DIACRITICS = re.compile("[\u064b-\u0652\u0670]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    text = _DIACRITICS.sub("", text.translate(_CHAR_MAP)).lower()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_query(text: Optional[str]) -> str:
+    # در عبارت جستجو نیم‌فاصله حذف می‌شود؛ هر دو شکل کلمه در ایندکس وجود دارد
+    return normalize_text((text or "").replace(ZWNJ, ""))
+
+
+def build_search_text(values: Iterable[Optional[str]]) -> str:
+    parts = []
+    for value in values:
+        if value is None or value == "":
+            continue
+        for word in normalize_text(str(value)).split(" "):
+            if ZWNJ in word:
+                # «درخواست‌ها» هم با «درخواستها» و هم با «درخواست ها» پیدا شود
+                parts.append(word.replace(ZWNJ, ""))
+                parts.append(word.replace(ZWNJ, " "))
+            elif word:
+                parts.append(word)
+    return " ".join(parts)
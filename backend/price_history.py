@@ -0,0 +1,85 @@
+# سابقه قیمت کالاها از استعلام‌ها و رسیدها؛ کلید هر کالا نام یکسان‌سازی‌شده آن است
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+from dates import as_datetime
+from persian_text import ZWNJ, normalize_text
+
+PRICE_SOURCES = ("inquiry", "receipt")
+
+# تغییر کمتر از این درصد بین دو نیمه سابقه «ثابت» در نظر گرفته می‌شود
+TREND_FLAT_PERCENT = 2.0
+
+
+def item_key(item_name: Optional[str]) -> str:
+    # «کاغذ A4»، «كاغذ  a4» و «کاغذ‌A4» یک کالا هستند
+    return normalize_text((item_name or "").replace(ZWNJ, " "))
+
+
+def observation(request: dict, source: str, entry: dict, observed_at: Any) -> Dict[str, Any]:
+    return {
+        "id": entry['id'],
+        "item_key": item_key(request.get('item_name')),
+        "item_name": request.get('item_name'),
+        "source": source,
+        "request_id": request['id'],
+        "request_number": request.get('request_number'),
+        "unit_price": float(entry['unit_price']),
+        "quantity": entry.get('quantity'),
+        "total_price": entry.get('total_price'),
+        "is_selected": entry.get('is_selected', False),
+        "observed_at": as_datetime(observed_at),
+    }
+
+
+def request_observations(request: dict) -> List[Dict[str, Any]]:
+    # بازسازی از روی سند درخواست؛ زمان استعلام از آخرین ثبت استعلام در تاریخچه خوانده می‌شود
+    if not request.get('item_name'):
+        return []
+    inquiries_at = request.get('created_at')
+    for entry in request.get('history') or []:
+        if entry.get('action') == "inquiries_added":
+            inquiries_at = entry.get('timestamp') or inquiries_at
+    docs = [observation(request, "inquiry", inq, inquiries_at) for inq in request.get('inquiries') or []]
+    docs.extend(
+        observation(request, "receipt", receipt, receipt.get('created_at') or request.get('created_at'))
+        for receipt in request.get('receipts') or []
+    )
+    return docs
+
+
+def _trend(prices: List[float]) -> Optional[Dict[str, Any]]:
+    # میانه نیمه جدیدتر در برابر میانه نیمه قدیمی‌تر؛ در برابر یک قیمت پرت پایدار است
+    if len(prices) < 2:
+        return None
+    half = len(prices) // 2
+    older, newer = median(prices[:half]), median(prices[-half:])
+    if older == 0:
+        return None
+    change = (newer - older) / older * 100
+    if abs(change) < TREND_FLAT_PERCENT:
+        direction = "flat"
+    else:
+        direction = "up" if change > 0 else "down"
+    return {"direction": direction, "change_percent": round(change, 2)}
+
+
+def price_stats(observations: List[dict]) -> Dict[str, Any]:
+    # observations به ترتیب زمان صعودی
+    if not observations:
+        return {"count": 0, "min": None, "max": None, "median": None, "last": None, "trend": None}
+    prices = [doc['unit_price'] for doc in observations]
+    last = observations[-1]
+    return {
+        "count": len(prices),
+        "min": min(prices),
+        "max": max(prices),
+        "median": median(prices),
+        "last": {
+            "unit_price": last['unit_price'],
+            "source": last['source'],
+            "request_number": last.get('request_number'),
+            "observed_at": last['observed_at'],
+        },
+        "trend": _trend(prices),
+    }
@@ -0,0 +1,207 @@
+# پروفایل یک درخواست به درخواست مدیر (هدر X-Profile یا پارامتر __profile) بدون نیاز به استقرار دوباره
+#
+#   X-Profile: cprofile   -> خروجی pstats (قابل باز کردن با snakeviz یا pstats)
+#   X-Profile: sample     -> نمونه‌برداری از پشته با خروجی collapsed برای flamegraph.pl / speedscope
+#
+# پروفایلر روی thread حلقه رویداد اجرا می‌شود، پس درخواست‌های همزمان دیگر هم در نتیجه دیده می‌شوند.
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from compression import CompressedArtifact
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_PARAM = "__profile"
+PROFILE_MODES = ("cprofile", "sample")
+ARTIFACT_MEDIA_TYPES = {
+    "pstats": "application/octet-stream",
+    "text": "text/plain; charset=utf-8",
+    "collapsed": "text/plain; charset=utf-8",
+}
+
+
+class ProfileRecord:
+    __slots__ = ("id", "mode", "method", "path", "user_id", "status", "duration_ms", "created_at", "data", "_artifacts")
+
+    def __init__(self, mode: str, method: str, path: str, user_id: Optional[str]):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.user_id = user_id
+        self.status = None
+        self.duration_ms = 0.0
+        self.created_at = datetime.now(timezone.utc)
+        # pstats: دیکشنری marshal شده؛ sample: شمارش پشته‌ها
+        self.data: Any = None
+        self._artifacts: Dict[str, CompressedArtifact] = {}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "user_id": self.user_id,
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 2),
+            "created_at": self.created_at,
+            "formats": ["pstats", "text"] if self.mode == "cprofile" else ["collapsed"],
+        }
+
+    def pstats_bytes(self) -> bytes:
+        return self.data
+
+    def text(self, limit: int = 60) -> str:
+        stats = pstats.Stats(_StatsSource(marshal.loads(self.data)), stream=io.StringIO())
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stats.stream.getvalue()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.data.most_common())
+
+    def artifact(self, format: str) -> CompressedArtifact:
+        # هر قالب یک بار ساخته و فشرده می‌شود و دانلودهای بعدی همان بایت‌ها را می‌گیرند
+        artifact = self._artifacts.get(format)
+        if artifact is None:
+            if format == "pstats":
+                content = self.pstats_bytes()
+            else:
+                content = (self.text() if format == "text" else self.collapsed()).encode()
+            artifact = self._artifacts[format] = CompressedArtifact(content, ARTIFACT_MEDIA_TYPES[format])
+        return artifact
+
+
+class _StatsSource:
+    # pstats.Stats فقط شیئی با create_stats و stats می‌خواهد
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfileStore:
+    def __init__(self, capacity: int = 20):
+        self._records: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def add(self, record: ProfileRecord):
+        with self._lock:
+            self._records.append(record)
+
+    def get(self, profile_id: str) -> Optional[ProfileRecord]:
+        with self._lock:
+            return next((record for record in self._records if record.id == profile_id), None)
+
+    def list(self) -> List[ProfileRecord]:
+        with self._lock:
+            return list(reversed(self._records))
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+class ProfilingMiddleware:
+    def __init__(
+        self,
+        app,
+        store: ProfileStore,
+        authorize: Callable[[Dict[str, str]], Optional[str]],
+        sample_interval: float = 0.005,
+    ):
+        self.app = app
+        self.store = store
+        # شناسه کاربر مدیر را برمی‌گرداند؛ برای بقیه None
+        self.authorize = authorize
+        self.sample_interval = sample_interval
+        # cProfile همزمان فقط یک پروفایل فعال را پشتیبانی می‌کند
+        self._busy = threading.Lock()
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value.decode("latin-1").strip().lower()
+        if PROFILE_QUERY_PARAM.encode() in scope.get("query_string", b""):
+            values = parse_qs(scope["query_string"].decode("latin-1")).get(PROFILE_QUERY_PARAM)
+            return values[0].lower() if values else None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = self._requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+        if mode not in PROFILE_MODES:
+            mode = "cprofile"
+
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        user_id = self.authorize(headers)
+        if not user_id or not self._busy.acquire(blocking=False):
+            # کاربر غیرمدیر یا پروفایل دیگری در حال اجرا: درخواست عادی اجرا می‌شود
+            await self.app(scope, receive, send)
+            return
+
+        record = ProfileRecord(mode, scope["method"], scope["path"], user_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record.status = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", record.id.encode())]
+            await send(message)
+
+        profiler = sampler = None
+        started = time.perf_counter()
+        try:
+            if mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                sampler = StackSampler(threading.get_ident(), self.sample_interval)
+                sampler.start()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record.duration_ms = (time.perf_counter() - started) * 1000
+            if profiler is not None:
+                profiler.disable()
+                profiler.create_stats()
+                record.data = marshal.dumps(profiler.stats)
+            if sampler is not None:
+                record.data = sampler.stop()
+            self._busy.release()
+            self.store.add(record)
@@ -0,0 +1,251 @@
+# ثبت الگوی کوئری‌ها (مجموعه، عملیات، کلیدهای فیلتر و مرتب‌سازی) و گزارش کوئری‌های کند
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import current_request
+
+logger = logging.getLogger("slow_queries")
+
+TRACKED_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify", "insert", "getMore"}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# فیلدهای دستور که برای explain نگه داشته می‌شوند (بقیه مثل lsid و $clusterTime حذف می‌شوند)
+SAMPLE_FIELDS = {
+    "find": ("find", "filter", "sort", "projection", "limit", "skip", "hint"),
+    "aggregate": ("aggregate", "pipeline", "cursor", "allowDiskUse", "hint"),
+    "count": ("count", "query", "limit", "skip", "hint"),
+    "distinct": ("distinct", "key", "query"),
+}
+MAX_ROUTES_PER_SHAPE = 5
+MAX_OPEN_CURSORS = 10000
+
+
+def _shape(value: Any) -> Any:
+    # مقادیر حذف می‌شوند و فقط ساختار کلیدها و عملگرها باقی می‌ماند
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return [_shape(item) for item in value]
+        return "?"
+    return "?"
+
+
+def _describe(value: Any) -> str:
+    if isinstance(value, dict):
+        parts = []
+        for key, item in value.items():
+            parts.append(key if item == "?" else f"{key}:{_describe(item)}")
+        return "{" + ",".join(parts) + "}"
+    if isinstance(value, list):
+        return "[" + "|".join(_describe(item) for item in value) + "]"
+    return str(value)
+
+
+def _command_filter(name: str, command: dict) -> Tuple[Any, Any]:
+    if name == "find":
+        return command.get("filter") or {}, command.get("sort")
+    if name in ("count", "distinct"):
+        return command.get("query") or {}, None
+    if name == "findAndModify":
+        return command.get("query") or {}, command.get("sort")
+    if name == "update":
+        updates = command.get("updates") or [{}]
+        return updates[0].get("q") or {}, None
+    if name == "delete":
+        deletes = command.get("deletes") or [{}]
+        return deletes[0].get("q") or {}, None
+    if name == "aggregate":
+        # مراحل pipeline به همراه ساختار $match و $sort
+        stages = []
+        for stage in command.get("pipeline") or []:
+            for operator, body in stage.items():
+                stages.append({operator: _shape(body)} if operator in ("$match", "$sort") else operator)
+        return stages, None
+    return {}, None
+
+
+def fingerprint(name: str, command: dict) -> Tuple[str, str]:
+    collection = command.get(name)
+    collection = collection if isinstance(collection, str) else ""
+    query, sort = _command_filter(name, command)
+    shape = _describe(_shape(query)) if name != "aggregate" else _describe(query)
+    if sort:
+        shape += " sort=" + _describe(_shape(sort)).replace(":?", "")
+    return collection, f"{name} {collection} {shape}"
+
+
+class ShapeStats:
+    __slots__ = ("collection", "operation", "shape", "count", "total_ms", "max_ms", "slow", "returned", "routes", "sample")
+
+    def __init__(self, collection: str, operation: str, shape: str):
+        self.collection = collection
+        self.operation = operation
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow = 0
+        self.returned = 0
+        self.routes: Dict[str, int] = {}
+        self.sample: Optional[dict] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "shape": self.shape,
+            "collection": self.collection,
+            "operation": self.operation,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 2),
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "max_ms": round(self.max_ms, 2),
+            "slow": self.slow,
+            "docs_returned": self.returned,
+            "routes": dict(sorted(self.routes.items(), key=lambda item: -item[1])),
+        }
+
+
+class QueryShapeListener(monitoring.CommandListener):
+    def __init__(self, slow_ms: float = 100.0, max_shapes: int = 1000):
+        self.slow_ms = slow_ms
+        self.max_shapes = max_shapes
+        self.shapes: Dict[str, ShapeStats] = {}
+        self.dropped = 0
+        self.started_at = time.time()
+        self._pending: Dict[Tuple, Tuple[str, str, str, Optional[dict], Optional[int]]] = {}
+        # کرسرهای باز تا getMore به الگوی کوئری اصلی نسبت داده شود
+        self._cursors: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        name = event.command_name
+        if name == "killCursors":
+            with self._lock:
+                for cursor_id in event.command.get("cursors") or []:
+                    self._cursors.pop(cursor_id, None)
+            return
+        if name not in TRACKED_COMMANDS:
+            return
+        stats = current_request.get()
+        route = stats.route if stats is not None else "background"
+        sample = None
+        cursor_id = None
+        if name == "getMore":
+            cursor_id = event.command.get("getMore")
+            with self._lock:
+                key = self._cursors.get(cursor_id)
+            if key is None:
+                return
+            collection = event.command.get("collection", "")
+        else:
+            collection, key = fingerprint(name, event.command)
+            if name in EXPLAINABLE_COMMANDS:
+                sample = {field: event.command[field] for field in SAMPLE_FIELDS[name] if field in event.command}
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (key, collection, route, sample, cursor_id)
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+    def _finish(self, event, reply: Optional[dict]):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        key, collection, route, sample, cursor_id = pending
+        elapsed_ms = event.duration_micros / 1000.0
+        returned = 0
+        cursor = (reply or {}).get("cursor")
+        if isinstance(cursor, dict):
+            returned = len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+        elif reply and event.command_name in ("count", "update", "delete", "insert"):
+            returned = reply.get("n", 0)
+
+        with self._lock:
+            if isinstance(cursor, dict):
+                if cursor.get("id"):
+                    if len(self._cursors) >= MAX_OPEN_CURSORS:
+                        self._cursors.clear()
+                    self._cursors[cursor["id"]] = key
+                elif cursor_id is not None:
+                    self._cursors.pop(cursor_id, None)
+            stats = self.shapes.get(key)
+            if stats is None:
+                if len(self.shapes) >= self.max_shapes:
+                    self.dropped += 1
+                    return
+                operation = key.split(" ", 1)[0]
+                stats = self.shapes[key] = ShapeStats(collection, operation, key)
+            stats.count += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.returned += returned
+            if route in stats.routes or len(stats.routes) < MAX_ROUTES_PER_SHAPE:
+                stats.routes[route] = stats.routes.get(route, 0) + 1
+            if sample is not None:
+                stats.sample = sample
+            if elapsed_ms >= self.slow_ms:
+                stats.slow += 1
+
+        if elapsed_ms >= self.slow_ms:
+            logger.warning("Slow query %.1fms route=%s shape=%s returned=%d", elapsed_ms, route, key, returned)
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[ShapeStats]:
+        with self._lock:
+            shapes = list(self.shapes.values())
+        return sorted(shapes, key=lambda stats: getattr(stats, order_by), reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self.shapes.clear()
+            self._cursors.clear()
+            self.dropped = 0
+            self.started_at = time.time()
+
+
+def _find_execution_stats(explain: Any) -> Optional[dict]:
+    # خروجی explain برای aggregate بسته به نسخه سرور ساختار متفاوتی دارد
+    if isinstance(explain, dict):
+        if isinstance(explain.get("executionStats"), dict):
+            return explain["executionStats"]
+        for value in explain.values():
+            found = _find_execution_stats(value)
+            if found:
+                return found
+    elif isinstance(explain, list):
+        for value in explain:
+            found = _find_execution_stats(value)
+            if found:
+                return found
+    return None
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    stages = []
+    while isinstance(plan, dict):
+        if plan.get("stage"):
+            stages.append(plan["stage"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+async def explain_shape(db, stats: ShapeStats) -> Optional[Dict[str, Any]]:
+    if not stats.sample:
+        return None
+    explain = await db.command({"explain": stats.sample, "verbosity": "executionStats"})
+    execution = _find_execution_stats(explain) or {}
+    examined = execution.get("totalDocsExamined", 0)
+    returned = execution.get("nReturned", 0)
+    return {
+        "docs_examined": examined,
+        "keys_examined": execution.get("totalKeysExamined", 0),
+        "returned": returned,
+        "examined_per_returned": round(examined / returned, 2) if returned else examined,
+        "plan": _plan_stages(execution.get("executionStages")),
+    }
@@ -0,0 +1,60 @@
+# زمان‌بند درون‌فرآیندی؛ فقط workerی که قفل رهبری را در MongoDB دارد کارها را اجرا می‌کند
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderScheduler:
+    def __init__(self, locks_collection, name: str, interval: float, lease: float):
+        self.locks = locks_collection
+        self.name = name
+        self.interval = interval
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: List[Tuple[str, Callable[[], Awaitable[None]]]] = []
+
+    def add_job(self, name: str, job: Callable[[], Awaitable[None]]):
+        self.jobs.append((name, job))
+
+    async def acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lock = await self.locks.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # قفل در اختیار worker دیگری است و هنوز منقضی نشده
+            return False
+        return lock is not None and lock.get('owner') == self.owner
+
+    async def release(self):
+        await self.locks.delete_one({"_id": self.name, "owner": self.owner})
+
+    async def run_once(self):
+        if not await self.acquire():
+            return
+        for name, job in self.jobs:
+            try:
+                await job()
+            except Exception:
+                logger.exception("Scheduled job %s failed", name)
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(self.interval)
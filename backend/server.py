@@ -1,15 +1,19 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Response, Query, Header
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
 import os
 import logging
+import asyncio
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+import hashlib
+from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 from enum import Enum
@@ -20,7 +24,12 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from io import BytesIO
+from io import BytesIO, StringIO
+from starlette.concurrency import run_in_threadpool
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pydantic import ValidationError
+import csv
+import json
 from project_proposal import (
     ProjectProposal, ProjectProposalCreate, ProjectProposalUpdate,
     COOReview, AssignFeasibilityManager, RegisterProject,
@@ -31,14 +40,39 @@ from payment_request import (
     PaymentRequestStatus, PaymentReason, PaymentMethod, PaymentRow, PaymentRequestHistory,
     RequestType
 )
+from reference_cache import TTLCache
+from persian_text import build_search_text, normalize_query
+from price_history import PRICE_SOURCES, item_key, observation, price_stats, request_observations
+from analytics import StageDurationStore, WORKFLOWS, GROUP_BY_COLUMNS
+from scheduler import LeaderScheduler
+from dates import as_datetime, date_range, merge_filter
+from jalali import date_window, to_jalali
+from idempotency import IdempotencyMiddleware
+from metrics import CommandMetricsListener, MetricsMiddleware, PoolMetricsListener, render_metrics
+from query_shapes import QueryShapeListener, explain_shape
+from profiling import ProfileStore, ProfilingMiddleware
+from compression import CompressionMiddleware
+from zoneinfo import ZoneInfo
+from config import mongo_client_options, reporting_lag, reporting_read_preference
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+query_shapes = QueryShapeListener(
+    slow_ms=float(os.environ.get('SLOW_QUERY_MS', '100')),
+    max_shapes=int(os.environ.get('QUERY_SHAPES_MAX', '1000'))
+)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    event_listeners=[CommandMetricsListener(), PoolMetricsListener(), query_shapes],
+    **mongo_client_options()
+)
 db = client[os.environ['DB_NAME']]
+# گزارش‌ها، خروجی‌ها و آمار می‌توانند از secondary خوانده شوند
+reporting_db = client.get_database(os.environ['DB_NAME'], read_preference=reporting_read_preference())
 
 # JWT Secret
 JWT_SECRET = os.environ.get('JWT_SECRET', 'pardis-paj-khorasan-secret-2024')
@@ -212,12 +246,17 @@ class ReceiptConfirm(BaseModel):
 class InvoiceUpload(BaseModel):
     invoice_base64: str
 
+class BatchActionRequest(BaseModel):
+    request_ids: List[str]
+    notes: Optional[str] = None
+
 class Notification(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     request_id: str
     request_number: str
+    request_ids: List[str] = []  # برای اعلان‌های تجمیعی عملیات گروهی
     message: str
     is_read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -244,50 +283,522 @@ async def create_notification(user_id: str, request_id: str, request_number: str
         request_number=request_number,
         message=message
     )
-    doc = notification.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.notifications.insert_one(doc)
+    await db.notifications.insert_one(notification.model_dump())
+
+async def create_coalesced_notifications(items_by_user: Dict[str, List[Dict[str, Any]]], single_message, batch_message):
+    # برای هر گیرنده فقط یک اعلان ثبت می‌شود
+    docs = []
+    for user_id, items in items_by_user.items():
+        numbers = [item['request_number'] for item in items]
+        notification = Notification(
+            user_id=user_id,
+            request_id=items[0]['id'],
+            request_number=numbers[0] if len(items) == 1 else "، ".join(numbers),
+            request_ids=[item['id'] for item in items],
+            message=single_message(items[0]) if len(items) == 1 else batch_message(items)
+        )
+        docs.append(notification.model_dump())
+    if docs:
+        await db.notifications.insert_many(docs)
+
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '200'))
+
+async def apply_batch_transition(
+    collection: str,
+    request_ids: List[str],
+    from_status: str,
+    build_update,
+    projection: Optional[Dict[str, Any]] = None
+):
+    # یک تغییر وضعیت روی چند سند با یک bulk_write؛ شرط وضعیت برای هر سند جداگانه بررسی می‌شود
+    # خروجی: نتیجه هر شناسه (applied / conflict / not_found) و اسنادی که واقعا تغییر کرده‌اند
+    if len(request_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_SIZE} ids per batch")
+    
+    ids = list(dict.fromkeys(request_ids))
+    fields = {"_id": 0, "id": 1, "status": 1, "request_number": 1, "requester_id": 1, **(projection or {})}
+    found = {doc['id']: doc for doc in await db[collection].find({"id": {"$in": ids}}, fields).to_list(len(ids))}
+    
+    results = {}
+    eligible = []
+    for request_id in ids:
+        doc = found.get(request_id)
+        if not doc:
+            results[request_id] = "not_found"
+        elif doc['status'] != from_status:
+            results[request_id] = "conflict"
+        else:
+            eligible.append(doc)
+    
+    applied = []
+    if eligible:
+        # هر سند revision جداگانه‌ای از یک بازه رزروشده می‌گیرد تا صفحه‌بندی همگام‌سازی (revision > since)
+        # وسط دسته چیزی را جا نیندازد؛ موارد اعمال‌شده با revision مورد انتظار هر سند مشخص می‌شوند
+        first = await reserve_revisions(len(eligible))
+        now = datetime.now(timezone.utc)
+        expected = {doc['id']: first + offset for offset, doc in enumerate(eligible)}
+        await db[collection].bulk_write([
+            UpdateOne(
+                {"id": doc['id'], "status": from_status},
+                build_update(doc, {"updated_at": now, "revision": expected[doc['id']]})
+            )
+            for doc in eligible
+        ], ordered=False)
+        applied_ids = {
+            doc['id'] for doc in await db[collection].find(
+                {"id": {"$in": list(expected)}, "revision": {"$gte": first, "$lt": first + len(eligible)}},
+                {"_id": 0, "id": 1, "revision": 1}
+            ).to_list(len(eligible))
+            if doc['revision'] == expected[doc['id']]
+        }
+        for doc in eligible:
+            if doc['id'] in applied_ids:
+                results[doc['id']] = "applied"
+                applied.append(doc)
+            else:
+                results[doc['id']] = "conflict"
+    
+    return [{"id": request_id, "result": results[request_id]} for request_id in ids], applied
 
-async def get_next_request_number() -> str:
-    current_year = 1404  # سال شمسی
-    counter_doc = await db.counters.find_one({"type": "request_number", "year": current_year})
+def group_by_requester(docs: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        grouped.setdefault(doc['requester_id'], []).append(doc)
+    return grouped
+
+# revision قبل از ثبت نوشتن رزرو می‌شود، پس revision کوچک‌تر ممکن است دیرتر از بزرگ‌تر قابل مشاهده شود.
+# زمان آخرین رزروها روی خود شمارنده نگه داشته می‌شود تا مرز revisionهای «قطعی» مشخص باشد.
+REVISION_SETTLE_SECONDS = float(os.environ.get('REVISION_SETTLE_SECONDS', '30'))
+REVISION_LOG_SIZE = int(os.environ.get('REVISION_LOG_SIZE', '512'))
+
+async def reserve_revisions(count: int) -> int:
+    # یک بازه پیوسته از revisionها رزرو می‌شود؛ خروجی اولین شماره بازه است
+    counter_doc = await db.counters.find_one_and_update(
+        {"type": "revision"},
+        {
+            "$inc": {"counter": count},
+            "$push": {"reservations": {
+                "$each": [{"count": count, "at": datetime.now(timezone.utc)}],
+                "$slice": -REVISION_LOG_SIZE
+            }}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter_doc['counter'] - count + 1
+
+async def settled_revision(lag: timedelta = timedelta(0)) -> int:
+    # بزرگ‌ترین revision که همه revisionهای کوچک‌تر یا مساوی آن دست‌کم REVISION_SETTLE_SECONDS (+ lag)
+    # پیش رزرو شده‌اند؛ فرض بر این است که هر نوشتن در این مدت ثبت می‌شود
+    counter_doc = await db.counters.find_one({"type": "revision"}, {"_id": 0, "counter": 1, "reservations": 1})
     if not counter_doc:
-        await db.counters.insert_one({"type": "request_number", "year": current_year, "counter": 1})
-        return f"{current_year}-1"
-    else:
-        new_counter = counter_doc['counter'] + 1
-        await db.counters.update_one(
-            {"type": "request_number", "year": current_year},
-            {"$set": {"counter": new_counter}}
+        return 0
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=REVISION_SETTLE_SECONDS) - lag
+    end = counter_doc['counter']
+    for reservation in reversed(counter_doc.get('reservations') or []):
+        if as_datetime(reservation['at']) <= cutoff:
+            return end
+        end -= reservation['count']
+    # همه رزروهای ثبت‌شده جدیدترند؛ revisionهای قبل از قدیمی‌ترین آن‌ها
+    return end
+
+async def next_revision() -> int:
+    return await reserve_revisions(1)
+
+async def revision_stamp() -> Dict[str, Any]:
+    # هر تغییر در درخواست‌ها باید updated_at و revision را به‌روز کند تا همگام‌سازی درست کار کند
+    return {"updated_at": datetime.now(timezone.utc), "revision": await next_revision()}
+
+async def record_tombstones(kind: str, entities: List[dict], archived_to: Optional[str] = None):
+    # archived_to یعنی سند حذف نشده و به مجموعه بایگانی منتقل شده است
+    # owner_id برای محدود کردن همگام‌سازی به اسناد قابل مشاهده کاربر ثبت می‌شود
+    if not entities:
+        return
+    first = await reserve_revisions(len(entities))
+    now = datetime.now(timezone.utc)
+    docs = []
+    for offset, entity in enumerate(entities):
+        doc = {
+            "collection": WORKFLOW_COLLECTIONS[kind][0],
+            "id": entity['id'],
+            "owner_id": entity.get(OWNER_FIELDS[kind]),
+            "revision": first + offset,
+            "deleted_at": now
+        }
+        if archived_to:
+            doc['archived_to'] = archived_to
+        docs.append(doc)
+    await db.tombstones.insert_many(docs)
+
+# ==================== Date filters ====================
+# مرز روزها و ماه‌های جلالی بر اساس ساعت محلی محاسبه می‌شود
+REPORT_TIMEZONE = ZoneInfo(os.environ.get('REPORT_TIMEZONE', 'Asia/Tehran'))
+
+def parse_date_window(date_from: Optional[str], date_to: Optional[str]):
+    try:
+        return date_window(date_from, date_to, REPORT_TIMEZONE)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid date range: {e}")
+
+def created_between(query: Dict[str, Any], start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+    return merge_filter(query, date_range("created_at", gte=start, lt=end))
+
+def jalali_year(value: Any) -> int:
+    return to_jalali(as_datetime(value).astimezone(REPORT_TIMEZONE))[0]
+
+# ==================== Cold archive ====================
+# درخواست‌های خاتمه‌یافته قدیمی به مجموعه‌های بایگانی سالانه (بر اساس سال جلالی ایجاد) منتقل می‌شوند
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_MAX_BATCHES = int(os.environ.get('ARCHIVE_MAX_BATCHES', '10'))
+TERMINAL_STATUSES = {
+    "goods": [RequestStatus.COMPLETED, RequestStatus.REJECTED],
+    "payment": [PaymentRequestStatus.COMPLETED, PaymentRequestStatus.REJECTED],
+    "proposal": [ProposalStatus.REGISTERED, ProposalStatus.COMPLETED],
+}
+
+def archive_collection_name(collection: str, year: int) -> str:
+    return f"{collection}_archive_{year}"
+
+async def all_archive_collections(collection: str) -> List[str]:
+    prefix = f"{collection}_archive_"
+    names = await db.list_collection_names(filter={"name": {"$regex": f"^{prefix}[0-9]+$"}})
+    return sorted(names, key=lambda name: int(name[len(prefix):]))
+
+async def archive_collections(collection: str, start: Optional[datetime], end: Optional[datetime]) -> List[str]:
+    # بدون بازه تاریخ یا با بازه‌ای جدیدتر از آستانه بایگانی، فقط مجموعه اصلی خوانده می‌شود
+    if start is None and end is None:
+        return []
+    horizon = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    if start and start >= horizon:
+        return []
+    first_year = jalali_year(start) if start else 0
+    last_year = jalali_year(min(end, horizon) if end else horizon)
+    prefix = f"{collection}_archive_"
+    return [
+        name for name in await all_archive_collections(collection)
+        if first_year <= int(name[len(prefix):]) <= last_year
+    ]
+
+async def find_with_archive(
+    kind: str,
+    query: Dict[str, Any],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    projection: Optional[Dict[str, Any]] = None,
+    limit: int = 1000,
+    database=None
+) -> List[dict]:
+    collection = WORKFLOW_COLLECTIONS[kind][0]
+    projection = projection or {"_id": 0}
+    database = database if database is not None else db
+    docs = await database[collection].find(query, projection).to_list(limit)
+    for name in await archive_collections(collection, start, end):
+        if len(docs) >= limit:
+            break
+        docs.extend(await database[name].find(query, projection).to_list(limit - len(docs)))
+    return docs
+
+async def find_request(kind: str, entity_id: str, projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    collection = WORKFLOW_COLLECTIONS[kind][0]
+    projection = projection or {"_id": 0}
+    doc = await db[collection].find_one({"id": entity_id}, projection)
+    if doc is None:
+        tombstone = await db.tombstones.find_one(
+            {"collection": collection, "id": entity_id, "archived_to": {"$exists": True}},
+            {"_id": 0, "archived_to": 1}
         )
-        return f"{current_year}-{new_counter}"
+        if tombstone:
+            doc = await db[tombstone['archived_to']].find_one({"id": entity_id}, projection)
+    return doc
 
-async def get_next_receipt_number() -> str:
-    counter_doc = await db.counters.find_one({"type": "receipt_number"})
-    if not counter_doc:
-        await db.counters.insert_one({"type": "receipt_number", "counter": 1})
-        return "R-00001"
-    else:
-        new_counter = counter_doc['counter'] + 1
-        await db.counters.update_one(
-            {"type": "receipt_number"},
-            {"$set": {"counter": new_counter}}
+# ==================== Visibility ====================
+def goods_scope_query(current_user: dict) -> Dict[str, Any]:
+    user_roles = current_user.get('roles', [])
+    query = {}
+    # متقاضی فقط درخواست‌های خودش را می‌بیند
+    if UserRole.ADMIN not in user_roles:
+        if UserRole.REQUESTER in user_roles and len(user_roles) == 1:
+            query['requester_id'] = current_user['user_id']
+    return query
+
+def payment_scope_query(current_user: dict) -> Dict[str, Any]:
+    user_roles = current_user.get('roles', [])
+    query = {}
+    if UserRole.ADMIN not in user_roles:
+        special_roles = [UserRole.FINANCIAL, UserRole.DEV_MANAGER]
+        has_special_role = any(role in user_roles for role in special_roles)
+        if not has_special_role:
+            query['requester_id'] = current_user['user_id']
+    return query
+
+def proposal_scope_query(current_user: dict) -> Dict[str, Any]:
+    user_roles = current_user.get('roles', [])
+    query = {}
+    if UserRole.ADMIN not in user_roles:
+        special_roles = [UserRole.COO, UserRole.DEV_MANAGER, UserRole.PROJECT_CONTROL]
+        has_special_role = any(role in user_roles for role in special_roles)
+        if not has_special_role:
+            query['proposer_id'] = current_user['user_id']
+    return query
+
+# فیلدهای مورد نیاز صفحات لیست (بدون فایل‌های base64 و تاریخچه)
+SUMMARY_PROJECTIONS = {
+    "goods": {
+        "_id": 0, "id": 1, "request_number": 1, "requester_id": 1, "requester_name": 1, "item_name": 1,
+        "quantity": 1, "cost_center": 1, "status": 1, "created_at": 1, "updated_at": 1, "revision": 1
+    },
+    "payment": {
+        "_id": 0, "id": 1, "request_number": 1, "requester_id": 1, "requester_name": 1, "request_type": 1,
+        "request_type_other": 1, "total_amount": 1, "status": 1, "created_at": 1, "updated_at": 1, "revision": 1
+    },
+    "proposal": {
+        "_id": 0, "id": 1, "proposal_number": 1, "project_code": 1, "proposer_id": 1, "proposer_name": 1,
+        "title": 1, "project_type": 1, "status": 1, "created_at": 1, "updated_at": 1, "revision": 1
+    },
+}
+
+# فیلدهای مجاز برای ?fields= در هر نوع درخواست
+SELECTABLE_FIELDS = {
+    "goods": set(GoodsRequest.model_fields) | {"revision"},
+    "payment": set(PaymentRequest.model_fields) | {f"payment_row.{name}" for name in PaymentRow.model_fields} | {"revision"},
+    "proposal": set(ProjectProposal.model_fields) | {"revision"},
+}
+
+def field_projection(kind: str, fields: Optional[str]) -> Optional[Dict[str, Any]]:
+    # ?fields=request_number,status -> projection؛ بدون پارامتر کل سند برگردانده می‌شود
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    if not requested:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="fields must not be empty")
+    unknown = sorted(requested - SELECTABLE_FIELDS[kind])
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    # با انتخاب payment_row، زیرفیلدهای آن حذف می‌شوند تا path collision رخ ندهد
+    requested = {name for name in requested if "." not in name or name.split(".", 1)[0] not in requested}
+    projection = {"_id": 0, "id": 1}
+    projection.update({name: 1 for name in sorted(requested)})
+    return projection
+
+def with_fields(projection: Optional[Dict[str, Any]], *names: str) -> Optional[Dict[str, Any]]:
+    # فیلدهای لازم برای بررسی دسترسی و ETag که ممکن است درخواست نشده باشند
+    if projection is None:
+        return None
+    return {**projection, **{name: 1 for name in names}}
+
+def select_fields(doc: dict, projection: Optional[Dict[str, Any]]) -> dict:
+    if projection is None:
+        return doc
+    top_level = {name.split(".", 1)[0] for name in projection}
+    return {key: value for key, value in doc.items() if key in top_level}
+
+WORKFLOW_COLLECTIONS = {
+    "goods": ("goods_requests", goods_scope_query),
+    "payment": ("payment_requests", payment_scope_query),
+    "proposal": ("project_proposals", proposal_scope_query),
+}
+
+OWNER_FIELDS = {"goods": "requester_id", "payment": "requester_id", "proposal": "proposer_id"}
+
+async def bump_collection_revision(collection: str):
+    await db.counters.update_one(
+        {"type": "collection_revision", "collection": collection},
+        {"$inc": {"counter": 1}},
+        upsert=True
+    )
+    if collection in reference_caches:
+        reference_caches[collection].invalidate()
+
+async def get_collection_revision(collection: str) -> int:
+    counter_doc = await db.counters.find_one({"type": "collection_revision", "collection": collection})
+    return counter_doc['counter'] if counter_doc else 0
+
+# ==================== Reference data cache ====================
+REFERENCE_CACHE_TTL = float(os.environ.get('REFERENCE_CACHE_TTL', '300'))
+CACHE_SYNC_INTERVAL = float(os.environ.get('CACHE_SYNC_INTERVAL', '2'))
+
+reference_caches = {
+    "cost_centers": TTLCache(REFERENCE_CACHE_TTL),
+    "users": TTLCache(REFERENCE_CACHE_TTL),
+}
+known_collection_revisions: Dict[str, int] = {}
+background_tasks: List[asyncio.Task] = []
+
+async def get_users_with_role(role: UserRole) -> List[Dict[str, Any]]:
+    return await reference_caches["users"].get_or_load(
+        ("role", role.value),
+        lambda: db.users.find({"roles": role}, {"_id": 0, "id": 1, "full_name": 1}).to_list(100)
+    )
+
+async def watch_collection_revisions():
+    # سایر workerها با تغییر شمارنده revision از تغییر داده‌های مرجع باخبر می‌شوند
+    while True:
+        try:
+            counters = await db.counters.find({"type": "collection_revision"}, {"_id": 0}).to_list(100)
+            for counter_doc in counters:
+                name = counter_doc['collection']
+                if name in reference_caches and known_collection_revisions.get(name) != counter_doc['counter']:
+                    known_collection_revisions[name] = counter_doc['counter']
+                    reference_caches[name].invalidate()
+        except Exception:
+            logging.exception("Reference cache sync failed")
+        await asyncio.sleep(CACHE_SYNC_INTERVAL)
+
+# ==================== Conditional GET ====================
+def make_etag(kind: str, revision: Optional[int], projection: Optional[Dict[str, Any]] = None) -> str:
+    # با ?fields= هر مجموعه فیلد نمایش جداگانه‌ای است و validator خودش را می‌گیرد
+    if projection is None:
+        return f'W/"{kind}-{revision or 0}"'
+    fields = ",".join(sorted(name for name in projection if name != "_id"))
+    return f'W/"{kind}-{revision or 0}-{hashlib.sha1(fields.encode()).hexdigest()[:12]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # مقایسه ضعیف: پیشوند W/ در نظر گرفته نمی‌شود
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def ensure_goods_access(request: dict, current_user: dict):
+    # بررسی دسترسی
+    user_roles = current_user.get('roles', [])
+    if UserRole.ADMIN not in user_roles:
+        if request['requester_id'] != current_user['user_id']:
+            # بررسی اینکه آیا کاربر نقشی در این درخواست دارد یا نه
+            has_role = any(role in user_roles for role in [UserRole.PROCUREMENT, UserRole.MANAGEMENT, UserRole.FINANCIAL])
+            if not has_role:
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+# ==================== Search index ====================
+SEARCH_FIELDS = {
+    "goods": ["request_number", "item_name", "description", "requester_name", "cost_center"],
+    "payment": [
+        "request_number", "requester_name", "request_type_other", "payment_row.invoice_contract_number",
+        "payment_row.account_holder_name", "payment_row.bank_name", "payment_row.cost_center", "payment_row.notes"
+    ],
+    "proposal": [
+        "proposal_number", "project_code", "title", "objective", "description", "proposer_name",
+        "feasibility_manager_name"
+    ],
+}
+
+def _field_value(doc: dict, path: str) -> Any:
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _search_entry(kind: str, doc: dict) -> Dict[str, Any]:
+    return {
+        "owner_id": doc.get(OWNER_FIELDS[kind]),
+        "search_text": build_search_text(_field_value(doc, path) for path in SEARCH_FIELDS[kind])
+    }
+
+async def index_for_search(kind: str, doc: dict):
+    await db.search_index.update_one(
+        {"kind": kind, "entity_id": doc['id']},
+        {"$set": _search_entry(kind, doc)},
+        upsert=True
+    )
+
+async def index_many_for_search(kind: str, docs: List[dict]):
+    if not docs:
+        return
+    await db.search_index.bulk_write([
+        UpdateOne({"kind": kind, "entity_id": doc['id']}, {"$set": _search_entry(kind, doc)}, upsert=True)
+        for doc in docs
+    ], ordered=False)
+
+async def rebuild_search_index(batch_size: int = 500) -> int:
+    indexed = 0
+    for kind, (collection, _) in WORKFLOW_COLLECTIONS.items():
+        projection = {"_id": 0, "id": 1, OWNER_FIELDS[kind]: 1}
+        projection.update({path: 1 for path in SEARCH_FIELDS[kind]})
+        batch = []
+        async for doc in db[collection].find({}, projection).batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) == batch_size:
+                await index_many_for_search(kind, batch)
+                indexed += len(batch)
+                batch = []
+        await index_many_for_search(kind, batch)
+        indexed += len(batch)
+    return indexed
+
+async def increment_counter(query: Dict[str, Any], count: int = 1) -> int:
+    # افزایش اتمی شمارنده؛ خروجی مقدار جدید شمارنده است
+    try:
+        counter_doc = await db.counters.find_one_and_update(
+            query,
+            {"$inc": {"counter": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
-        return f"R-{new_counter:05d}"
+    except DuplicateKeyError:
+        # upsert همزمان دیگری شمارنده را ساخته است؛ این بار سند موجود به‌روز می‌شود
+        counter_doc = await db.counters.find_one_and_update(
+            query,
+            {"$inc": {"counter": count}},
+            return_document=ReturnDocument.AFTER
+        )
+    return counter_doc['counter']
+
+async def reserve_request_numbers(count: int) -> List[str]:
+    current_year = 1404  # سال شمسی
+    last = await increment_counter({"type": "request_number", "year": current_year}, count)
+    return [f"{current_year}-{n}" for n in range(last - count + 1, last + 1)]
+
+async def get_next_request_number() -> str:
+    return (await reserve_request_numbers(1))[0]
+
+async def get_next_receipt_number() -> str:
+    return f"R-{await increment_counter({'type': 'receipt_number'}):05d}"
 
 async def get_next_proposal_number() -> str:
     current_year = 1404
-    counter_doc = await db.counters.find_one({"type": "proposal_number", "year": current_year})
-    if not counter_doc:
-        await db.counters.insert_one({"type": "proposal_number", "year": current_year, "counter": 1})
-        return f"PP-{current_year}-1"
-    else:
-        new_counter = counter_doc['counter'] + 1
-        await db.counters.update_one(
-            {"type": "proposal_number", "year": current_year},
-            {"$set": {"counter": new_counter}}
-        )
-        return f"PP-{current_year}-{new_counter}"
+    return f"PP-{current_year}-{await increment_counter({'type': 'proposal_number', 'year': current_year})}"
+
+# ==================== Price history ====================
+PRICE_OBSERVATION_PROJECTION = {
+    "_id": 0, "id": 1, "item_name": 1, "request_number": 1, "created_at": 1, "history.action": 1,
+    "history.timestamp": 1, "inquiries.id": 1, "inquiries.unit_price": 1, "inquiries.quantity": 1,
+    "inquiries.total_price": 1, "inquiries.is_selected": 1, "receipts.id": 1, "receipts.unit_price": 1,
+    "receipts.quantity": 1, "receipts.total_price": 1, "receipts.created_at": 1,
+}
+
+async def record_price_observations(docs: List[dict]):
+    # upsert بر اساس شناسه استعلام/رسید تا بازسازی تکراری ایجاد نکند
+    if not docs:
+        return
+    await db.price_observations.bulk_write([
+        UpdateOne({"id": doc['id']}, {"$set": doc}, upsert=True) for doc in docs
+    ], ordered=False)
+
+async def rebuild_price_observations(batch_size: int = 500) -> int:
+    # سابقه قیمت سال‌های بایگانی‌شده هم بازسازی می‌شود
+    recorded = 0
+    batch = []
+    for collection in ["goods_requests", *(await all_archive_collections("goods_requests"))]:
+        async for request in db[collection].find({}, PRICE_OBSERVATION_PROJECTION).batch_size(batch_size):
+            batch.extend(request_observations(request))
+            if len(batch) >= batch_size:
+                await record_price_observations(batch)
+                recorded += len(batch)
+                batch = []
+    await record_price_observations(batch)
+    return recorded + len(batch)
 
 # ==================== Routes ====================
 
@@ -309,9 +820,8 @@ async def register(user_data: UserCreate, current_user: dict = Depends(get_curre
         roles=user_data.roles
     )
     
-    doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.users.insert_one(doc)
+    await db.users.insert_one(user.model_dump())
+    await bump_collection_revision("users")
     
     return {"message": "User created successfully", "user_id": user.id}
 
@@ -337,11 +847,21 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 # User Management
 @api_router.get("/users", response_model=List[UserResponse])
-async def get_users(current_user: dict = Depends(get_current_user)):
+async def get_users(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     if UserRole.ADMIN not in current_user.get('roles', []):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     
+    revision = await reference_caches["users"].get_or_load("revision", lambda: get_collection_revision("users"))
+    etag = make_etag("users", revision)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
     users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
+    set_etag(response, etag)
     return users
 
 @api_router.put("/users/{user_id}")
@@ -363,6 +883,7 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: dict =
     result = await db.users.update_one({"id": user_id}, {"$set": update_data})
     if result.matched_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    await bump_collection_revision("users")
     
     return {"message": "User updated successfully"}
 
@@ -374,23 +895,25 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    await bump_collection_revision("users")
     
     return {"message": "User deleted successfully"}
 
 # Cost Centers
 @api_router.get("/cost-centers")
-async def get_cost_centers(current_user: dict = Depends(get_current_user)):
-    centers = await db.cost_centers.find({}, {"_id": 0}).to_list(100)
-    if not centers:
-        # Initialize default cost centers
-        default_centers = [
-            CostCenter(name="دفتر", name_en="Office"),
-            CostCenter(name="قیر", name_en="Bitumen"),
-            CostCenter(name="پارادیزو", name_en="Paradiso")
-        ]
-        for center in default_centers:
-            await db.cost_centers.insert_one(center.model_dump())
-        centers = [c.model_dump() for c in default_centers]
+async def get_cost_centers(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    cache = reference_caches["cost_centers"]
+    revision = await cache.get_or_load("revision", lambda: get_collection_revision("cost_centers"))
+    etag = make_etag("cost_centers", revision)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    centers = await cache.get_or_load("all", lambda: db.cost_centers.find({}, {"_id": 0}).to_list(100))
+    set_etag(response, etag)
     return centers
 
 @api_router.post("/cost-centers")
@@ -398,7 +921,11 @@ async def create_cost_center(center: CostCenter, current_user: dict = Depends(ge
     if UserRole.ADMIN not in current_user.get('roles', []):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     
-    await db.cost_centers.insert_one(center.model_dump())
+    try:
+        await db.cost_centers.insert_one(center.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cost center already exists")
+    await bump_collection_revision("cost_centers")
     return {"message": "Cost center created", "id": center.id}
 
 @api_router.put("/cost-centers/{center_id}")
@@ -406,12 +933,16 @@ async def update_cost_center(center_id: str, name: str, name_en: str, current_us
     if UserRole.ADMIN not in current_user.get('roles', []):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     
-    result = await db.cost_centers.update_one(
-        {"id": center_id},
-        {"$set": {"name": name, "name_en": name_en}}
-    )
+    try:
+        result = await db.cost_centers.update_one(
+            {"id": center_id},
+            {"$set": {"name": name, "name_en": name_en}}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cost center already exists")
     if result.matched_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    await bump_collection_revision("cost_centers")
     return {"message": "Cost center updated"}
 
 @api_router.delete("/cost-centers/{center_id}")
@@ -422,13 +953,97 @@ async def delete_cost_center(center_id: str, current_user: dict = Depends(get_cu
     result = await db.cost_centers.delete_one({"id": center_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    await bump_collection_revision("cost_centers")
     return {"message": "Cost center deleted"}
 
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return {name: cache.stats() for name, cache in reference_caches.items()}
+
+QUERY_SHAPE_ORDERS = {"total_ms", "max_ms", "count", "slow", "returned"}
+
+@api_router.get("/admin/query-shapes")
+async def get_query_shapes(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = "total_ms",
+    explain: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    if order_by not in QUERY_SHAPE_ORDERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid order_by")
+    
+    shapes = []
+    for stats in query_shapes.top(limit, order_by):
+        item = stats.as_dict()
+        if explain:
+            # explain دوباره کوئری نمونه را اجرا می‌کند؛ فقط برای بررسی دستی استفاده شود
+            try:
+                item['explain'] = await explain_shape(db, stats)
+            except Exception as e:
+                item['explain'] = {"error": str(e)}
+        shapes.append(item)
+    return {
+        "since": datetime.fromtimestamp(query_shapes.started_at, timezone.utc),
+        "slow_threshold_ms": query_shapes.slow_ms,
+        "dropped_shapes": query_shapes.dropped,
+        "shapes": shapes
+    }
+
+@api_router.delete("/admin/query-shapes")
+async def reset_query_shapes(current_user: dict = Depends(get_current_user)):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    query_shapes.reset()
+    return {"message": "Query shape statistics reset"}
+
+# پروفایل‌های گرفته‌شده با هدر X-Profile در حافظه همین worker نگه داشته می‌شوند
+profile_store = ProfileStore(int(os.environ.get('PROFILE_BUFFER_SIZE', '20')))
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: dict = Depends(get_current_user)):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return [record.summary() for record in profile_store.list()]
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def download_profile(
+    profile_id: str,
+    format: str = "text",
+    accept_encoding: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    record = profile_store.get(profile_id)
+    if not record:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if format not in record.summary()['formats']:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Profile is available as {', '.join(record.summary()['formats'])}")
+    
+    # محصول فشرده‌شده روی رکورد نگه داشته می‌شود و میان‌افزار فشرده‌سازی از آن عبور می‌کند
+    artifact = await run_in_threadpool(record.artifact, format)
+    headers = {}
+    if format != "text":
+        headers["Content-Disposition"] = f"attachment; filename=profile-{record.id}.{format}"
+    return artifact.response(accept_encoding, headers)
+
 # Goods Requests
 @api_router.post("/goods-requests")
 async def create_goods_request(request_data: GoodsRequestCreate, current_user: dict = Depends(get_current_user)):
     request_number = await get_next_request_number()
     
+    doc = build_goods_request_doc(request_data, request_number, current_user)
+    doc['revision'] = await next_revision()
+    await db.goods_requests.insert_one(doc)
+    await index_for_search("goods", doc)
+    
+    return {"message": "Request created", "request_id": doc['id'], "request_number": request_number}
+
+def build_goods_request_doc(request_data: GoodsRequestCreate, request_number: str, current_user: dict) -> Dict[str, Any]:
     goods_request = GoodsRequest(
         request_number=request_number,
         requester_id=current_user['user_id'],
@@ -449,53 +1064,150 @@ async def create_goods_request(request_data: GoodsRequestCreate, current_user: d
     )
     
     doc = goods_request.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    for i, hist in enumerate(doc['history']):
-        doc['history'][i]['timestamp'] = hist['timestamp'].isoformat()
-    
-    await db.goods_requests.insert_one(doc)
+    return doc
+
+# ورود گروهی درخواست‌ها از فایل اکسل
+MAX_IMPORT_ROWS = int(os.environ.get('MAX_IMPORT_ROWS', '2000'))
+
+IMPORT_COLUMN_ALIASES = {
+    "item_name": "item_name", "نام کالا": "item_name", "کالا": "item_name",
+    "quantity": "quantity", "تعداد": "quantity", "تعداد درخواستی": "quantity",
+    "cost_center": "cost_center", "مرکز هزینه": "cost_center",
+    "need_date": "need_date", "تاریخ نیاز": "need_date",
+    "description": "description", "توضیحات": "description",
+}
+
+def _import_cell(field: str, value: Any) -> Any:
+    if value is None or field == "quantity":
+        return value
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return str(value).strip() or None
+
+def parse_goods_import(file_obj) -> List[Dict[str, Any]]:
+    # خواندن جریانی فایل؛ ردیف‌ها یکی‌یکی اعتبارسنجی می‌شوند
+    wb = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return []
+        columns = [IMPORT_COLUMN_ALIASES.get(str(h).strip()) if h is not None else None for h in header]
+        if "item_name" not in columns:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing item_name column")
+        
+        parsed = []
+        for row_number, row in enumerate(rows, start=2):
+            if all(value is None for value in row):
+                continue
+            if len(parsed) >= MAX_IMPORT_ROWS:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_IMPORT_ROWS} rows per import")
+            data = {field: _import_cell(field, value) for field, value in zip(columns, row) if field}
+            try:
+                parsed.append({"row": row_number, "data": GoodsRequestCreate(**data)})
+            except ValidationError as e:
+                errors = [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+                parsed.append({"row": row_number, "errors": errors})
+        return parsed
+    finally:
+        wb.close()
+
+@api_router.post("/goods-requests/import")
+async def import_goods_requests(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    try:
+        parsed = await run_in_threadpool(parse_goods_import, file.file)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid XLSX file")
+    
+    report = {row['row']: {"row": row['row'], "status": "invalid", "errors": row['errors']} for row in parsed if 'errors' in row}
+    valid = [row for row in parsed if 'data' in row]
+    
+    docs = []
+    if valid:
+        # یک بار رزرو شماره برای کل فایل
+        numbers = await reserve_request_numbers(len(valid))
+        first_revision = await reserve_revisions(len(valid))
+        for i, (row, request_number) in enumerate(zip(valid, numbers)):
+            doc = build_goods_request_doc(row['data'], request_number, current_user)
+            doc['need_date'] = row['data'].need_date
+            doc['revision'] = first_revision + i
+            docs.append(doc)
+        
+        failed = {}
+        try:
+            await db.goods_requests.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {err['index']: err.get('errmsg', 'Insert failed') for err in e.details.get('writeErrors', [])}
+        
+        inserted = []
+        for i, (row, doc) in enumerate(zip(valid, docs)):
+            if i in failed:
+                report[row['row']] = {"row": row['row'], "status": "failed", "errors": [failed[i]]}
+            else:
+                inserted.append(doc)
+                report[row['row']] = {
+                    "row": row['row'],
+                    "status": "created",
+                    "request_id": doc['id'],
+                    "request_number": doc['request_number']
+                }
+        await index_many_for_search("goods", inserted)
+        docs = inserted
     
-    return {"message": "Request created", "request_id": goods_request.id, "request_number": request_number}
+    return {
+        "created": len(docs),
+        "invalid": len(parsed) - len(valid),
+        "rows": [report[row_number] for row_number in sorted(report)]
+    }
 
 @api_router.get("/goods-requests")
-async def get_goods_requests(current_user: dict = Depends(get_current_user)):
-    user_roles = current_user.get('roles', [])
-    user_id = current_user['user_id']
-    
-    query = {}
-    # متقاضی فقط درخواست‌های خودش را می‌بیند
-    if UserRole.ADMIN not in user_roles:
-        if UserRole.REQUESTER in user_roles and len(user_roles) == 1:
-            query['requester_id'] = user_id
-    
-    requests = await db.goods_requests.find(query, {"_id": 0}).to_list(1000)
-    
-    # Convert datetime strings
+async def get_goods_requests(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("goods", fields)
+    start, end = parse_date_window(date_from, date_to)
+    query = created_between(goods_scope_query(current_user), start, end)
+    requests = await find_with_archive("goods", query, start, end, projection)
+    
+    # Convert legacy datetime strings
     for req in requests:
-        if isinstance(req.get('created_at'), str):
-            req['created_at'] = datetime.fromisoformat(req['created_at'])
-        if isinstance(req.get('updated_at'), str):
-            req['updated_at'] = datetime.fromisoformat(req['updated_at'])
+        for field in ('created_at', 'updated_at'):
+            if field in req:
+                req[field] = as_datetime(req[field])
     
     return requests
 
 @api_router.get("/goods-requests/{request_id}")
-async def get_goods_request(request_id: str, current_user: dict = Depends(get_current_user)):
-    request = await db.goods_requests.find_one({"id": request_id}, {"_id": 0})
+async def get_goods_request(
+    request_id: str,
+    response: Response,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("goods", fields)
+    if if_none_match:
+        # فقط فیلدهای لازم برای بررسی دسترسی و revision خوانده می‌شود
+        meta = await find_request("goods", request_id, {"_id": 0, "requester_id": 1, "revision": 1})
+        if not meta:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        ensure_goods_access(meta, current_user)
+        etag = make_etag("goods", meta.get('revision'), projection)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    request = await find_request("goods", request_id, with_fields(projection, "requester_id", "revision"))
     if not request:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     
-    # بررسی دسترسی
-    user_roles = current_user.get('roles', [])
-    if UserRole.ADMIN not in user_roles:
-        if request['requester_id'] != current_user['user_id']:
-            # بررسی اینکه آیا کاربر نقشی در این درخواست دارد یا نه
-            has_role = any(role in user_roles for role in [UserRole.PROCUREMENT, UserRole.MANAGEMENT, UserRole.FINANCIAL])
-            if not has_role:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
-    
-    return request
+    ensure_goods_access(request, current_user)
+    set_etag(response, make_etag("goods", request.get('revision'), projection))
+    return select_fields(request, projection)
 
 @api_router.put("/goods-requests/{request_id}")
 async def update_goods_request(request_id: str, request_data: GoodsRequestUpdate, current_user: dict = Depends(get_current_user)):
@@ -509,7 +1221,7 @@ async def update_goods_request(request_id: str, request_data: GoodsRequestUpdate
     if request['status'] != RequestStatus.DRAFT:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Can only edit draft requests")
     
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = await revision_stamp()
     if request_data.item_name:
         update_data['item_name'] = request_data.item_name
     if request_data.quantity:
@@ -522,6 +1234,7 @@ async def update_goods_request(request_id: str, request_data: GoodsRequestUpdate
         update_data['description'] = request_data.description
     
     await db.goods_requests.update_one({"id": request_id}, {"$set": update_data})
+    await index_for_search("goods", {**request, **update_data})
     return {"message": "Request updated"}
 
 @api_router.post("/goods-requests/{request_id}/submit")
@@ -549,17 +1262,14 @@ async def submit_request(request_id: str, current_user: dict = Depends(get_curre
         {
             "$set": {
                 "status": RequestStatus.PENDING_PROCUREMENT,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
-            "$push": {"history": {
-                **history_entry.model_dump(),
-                "timestamp": history_entry.timestamp.isoformat()
-            }}
+            "$push": {"history": history_entry.model_dump()}
         }
     )
     
     # Notify procurement users
-    procurement_users = await db.users.find({"roles": UserRole.PROCUREMENT}).to_list(100)
+    procurement_users = await get_users_with_role(UserRole.PROCUREMENT)
     for user in procurement_users:
         await create_notification(
             user['id'],
@@ -601,17 +1311,19 @@ async def add_inquiries(request_id: str, inquiries: List[InquiryCreate], current
             "$set": {
                 "inquiries": [inq.model_dump() for inq in inquiry_objs],
                 "status": RequestStatus.PENDING_MANAGEMENT,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
-            "$push": {"history": {
-                **history_entry.model_dump(),
-                "timestamp": history_entry.timestamp.isoformat()
-            }}
+            "$push": {"history": history_entry.model_dump()}
         }
     )
+    # استعلام‌های ردشده قبلی (reject_with_edit) جایگزین شده‌اند و در سابقه قیمت نمی‌مانند
+    await db.price_observations.delete_many({"request_id": request_id, "source": "inquiry"})
+    await record_price_observations([
+        observation(request, "inquiry", inq.model_dump(), history_entry.timestamp) for inq in inquiry_objs
+    ])
     
     # Notify management users
-    management_users = await db.users.find({"roles": UserRole.MANAGEMENT}).to_list(100)
+    management_users = await get_users_with_role(UserRole.MANAGEMENT)
     for user in management_users:
         await create_notification(
             user['id'],
@@ -663,17 +1375,19 @@ async def select_inquiry(request_id: str, selection: InquirySelect, current_user
                 "$set": {
                     "inquiries": inquiries,
                     "status": RequestStatus.PENDING_PURCHASE,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    **(await revision_stamp())
                 },
-                "$push": {"history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }}
+                "$push": {"history": history_entry.model_dump()}
             }
         )
+        await db.price_observations.update_many(
+            {"request_id": request_id, "source": "inquiry"},
+            {"$set": {"is_selected": False}}
+        )
+        await db.price_observations.update_one({"id": selection.inquiry_id}, {"$set": {"is_selected": True}})
         
         # Notify procurement to purchase
-        procurement_users = await db.users.find({"roles": UserRole.PROCUREMENT}).to_list(100)
+        procurement_users = await get_users_with_role(UserRole.PROCUREMENT)
         for user in procurement_users:
             await create_notification(
                 user['id'],
@@ -700,17 +1414,14 @@ async def select_inquiry(request_id: str, selection: InquirySelect, current_user
             {
                 "$set": {
                     "status": RequestStatus.PENDING_PROCUREMENT,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    **(await revision_stamp())
                 },
-                "$push": {"history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }}
+                "$push": {"history": history_entry.model_dump()}
             }
         )
         
         # Notify procurement
-        procurement_users = await db.users.find({"roles": UserRole.PROCUREMENT}).to_list(100)
+        procurement_users = await get_users_with_role(UserRole.PROCUREMENT)
         for user in procurement_users:
             await create_notification(
                 user['id'],
@@ -737,12 +1448,9 @@ async def select_inquiry(request_id: str, selection: InquirySelect, current_user
             {
                 "$set": {
                     "status": RequestStatus.REJECTED,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    **(await revision_stamp())
                 },
-                "$push": {"history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }}
+                "$push": {"history": history_entry.model_dump()}
             }
         )
         
@@ -791,20 +1499,15 @@ async def add_receipt(request_id: str, receipt_data: ReceiptCreate, current_user
         {
             "$set": {
                 "status": RequestStatus.PENDING_RECEIPT,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {
-                "receipts": {
-                    **receipt.model_dump(),
-                    "created_at": receipt.created_at.isoformat()
-                },
-                "history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }
+                "receipts": receipt.model_dump(),
+                "history": history_entry.model_dump()
             }
         }
     )
+    await record_price_observations([observation(request, "receipt", receipt.model_dump(), receipt.created_at)])
     
     # Notify requester
     await create_notification(
@@ -830,7 +1533,7 @@ async def confirm_receipt_procurement(request_id: str, confirm: ReceiptConfirm,
     for receipt in receipts:
         if receipt['id'] == confirm.receipt_id:
             receipt['confirmed_by_procurement'] = True
-            receipt['procurement_confirmed_at'] = datetime.now(timezone.utc).isoformat()
+            receipt['procurement_confirmed_at'] = datetime.now(timezone.utc)
             receipt['procurement_receipt_date'] = confirm.receipt_date
             receipt['procurement_receipt_time'] = confirm.receipt_time
             receipt_found = True
@@ -841,7 +1544,7 @@ async def confirm_receipt_procurement(request_id: str, confirm: ReceiptConfirm,
     
     await db.goods_requests.update_one(
         {"id": request_id},
-        {"$set": {"receipts": receipts, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"receipts": receipts, **(await revision_stamp())}}
     )
     
     return {"message": "Receipt confirmed by procurement"}
@@ -860,7 +1563,7 @@ async def confirm_receipt_requester(request_id: str, confirm: ReceiptConfirm, cu
     for receipt in receipts:
         if receipt['id'] == confirm.receipt_id:
             receipt['confirmed_by_requester'] = True
-            receipt['requester_confirmed_at'] = datetime.now(timezone.utc).isoformat()
+            receipt['requester_confirmed_at'] = datetime.now(timezone.utc)
             receipt['requester_receipt_date'] = confirm.receipt_date
             receipt['requester_receipt_time'] = confirm.receipt_time
             receipt_found = True
@@ -871,7 +1574,7 @@ async def confirm_receipt_requester(request_id: str, confirm: ReceiptConfirm, cu
     
     await db.goods_requests.update_one(
         {"id": request_id},
-        {"$set": {"receipts": receipts, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"receipts": receipts, **(await revision_stamp())}}
     )
     
     # Check if all receipts confirmed
@@ -879,10 +1582,10 @@ async def confirm_receipt_requester(request_id: str, confirm: ReceiptConfirm, cu
     if all_confirmed:
         await db.goods_requests.update_one(
             {"id": request_id},
-            {"$set": {"status": RequestStatus.PENDING_INVOICE}}
+            {"$set": {"status": RequestStatus.PENDING_INVOICE, **(await revision_stamp())}}
         )
         # Notify procurement to upload invoice
-        procurement_users = await db.users.find({"roles": UserRole.PROCUREMENT}).to_list(100)
+        procurement_users = await get_users_with_role(UserRole.PROCUREMENT)
         for user in procurement_users:
             await create_notification(
                 user['id'],
@@ -918,17 +1621,14 @@ async def upload_invoice(request_id: str, invoice: InvoiceUpload, current_user:
             "$set": {
                 "invoice_base64": invoice.invoice_base64,
                 "status": RequestStatus.PENDING_FINANCIAL,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
-            "$push": {"history": {
-                **history_entry.model_dump(),
-                "timestamp": history_entry.timestamp.isoformat()
-            }}
+            "$push": {"history": history_entry.model_dump()}
         }
     )
     
     # Notify financial users
-    financial_users = await db.users.find({"roles": UserRole.FINANCIAL}).to_list(100)
+    financial_users = await get_users_with_role(UserRole.FINANCIAL)
     for user in financial_users:
         await create_notification(
             user['id'],
@@ -939,6 +1639,39 @@ async def upload_invoice(request_id: str, invoice: InvoiceUpload, current_user:
     
     return {"message": "Invoice uploaded"}
 
+@api_router.post("/goods-requests/batch/approve-financial")
+async def batch_approve_financial(batch: BatchActionRequest, current_user: dict = Depends(get_current_user)):
+    if UserRole.FINANCIAL not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    
+    history_entry = RequestHistory(
+        action=ActionType.COMPLETED,
+        actor_id=current_user['user_id'],
+        actor_name=current_user['full_name'],
+        from_status=RequestStatus.PENDING_FINANCIAL,
+        to_status=RequestStatus.COMPLETED,
+        notes=batch.notes
+    )
+    history_doc = history_entry.model_dump()
+    
+    results, applied = await apply_batch_transition(
+        "goods_requests",
+        batch.request_ids,
+        RequestStatus.PENDING_FINANCIAL,
+        lambda doc, stamp: {
+            "$set": {"status": RequestStatus.COMPLETED, **stamp},
+            "$push": {"history": history_doc}
+        }
+    )
+    
+    await create_coalesced_notifications(
+        group_by_requester(applied),
+        lambda item: f"درخواست {item['request_number']} تکمیل شد",
+        lambda items: f"{len(items)} درخواست شما تکمیل شد: {'، '.join(i['request_number'] for i in items)}"
+    )
+    
+    return {"results": results, "applied": len(applied)}
+
 @api_router.post("/goods-requests/{request_id}/approve-financial")
 async def approve_financial(request_id: str, action: ActionRequest, current_user: dict = Depends(get_current_user)):
     if UserRole.FINANCIAL not in current_user.get('roles', []):
@@ -965,12 +1698,9 @@ async def approve_financial(request_id: str, action: ActionRequest, current_user
         {
             "$set": {
                 "status": RequestStatus.COMPLETED,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
-            "$push": {"history": {
-                **history_entry.model_dump(),
-                "timestamp": history_entry.timestamp.isoformat()
-            }}
+            "$push": {"history": history_entry.model_dump()}
         }
     )
     
@@ -1022,12 +1752,9 @@ async def reject_request(request_id: str, action: ActionRequest, current_user: d
         {
             "$set": {
                 "status": previous_status,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
-            "$push": {"history": {
-                **history_entry.model_dump(),
-                "timestamp": history_entry.timestamp.isoformat()
-            }}
+            "$push": {"history": history_entry.model_dump()}
         }
     )
     
@@ -1041,7 +1768,384 @@ async def reject_request(request_id: str, action: ActionRequest, current_user: d
     
     return {"message": "Request rejected"}
 
+# Delta sync
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+
+@api_router.get("/sync")
+async def sync_changes(since: int = 0, current_user: dict = Depends(get_current_user)):
+    # تضمین: هر تغییری که حداکثر REVISION_SETTLE_SECONDS پس از رزرو revision ثبت شود، در پاسخ همین
+    # درخواست یا درخواست بعدی با since=token دیده می‌شود. توکن از revision «قطعی» بالاتر نمی‌رود، پس
+    # تغییرات بالای توکن ممکن است دوباره ارسال شوند؛ کلاینت برای هر id نسخه با revision بزرگ‌تر را نگه می‌دارد.
+    token = max(since, await settled_revision())
+    
+    result = {"has_more": False}
+    truncated_at = []
+    for name, (collection, scope_query) in WORKFLOW_COLLECTIONS.items():
+        query = {**scope_query(current_user), "revision": {"$gt": since}}
+        changed = await db[collection].find(query, SUMMARY_PROJECTIONS[name]).sort("revision", 1).to_list(SYNC_PAGE_SIZE)
+        if len(changed) == SYNC_PAGE_SIZE:
+            truncated_at.append(changed[-1]['revision'])
+        result[name] = changed
+    
+    visibility = []
+    for name, (collection, scope_query) in WORKFLOW_COLLECTIONS.items():
+        clause = {"collection": collection}
+        if scope_query(current_user):
+            clause['owner_id'] = current_user['user_id']
+        visibility.append(clause)
+    tombstones = await db.tombstones.find(
+        {"revision": {"$gt": since}, "$or": visibility},
+        {"_id": 0, "collection": 1, "id": 1, "revision": 1, "archived_to": 1}
+    ).sort("revision", 1).to_list(SYNC_PAGE_SIZE)
+    if len(tombstones) == SYNC_PAGE_SIZE:
+        truncated_at.append(tombstones[-1]['revision'])
+    result['deleted'] = tombstones
+    
+    if truncated_at:
+        token = min(token, min(truncated_at))
+        result['has_more'] = token > since
+    result['token'] = token
+    return result
+
+# Batch fetch
+# بررسی دسترسی هر نوع، همان بررسی endpoint جزئیات
+DETAIL_ACCESS_CHECKS = {"goods": ensure_goods_access}
+
+def can_access(kind: str, doc: dict, current_user: dict) -> bool:
+    check = DETAIL_ACCESS_CHECKS.get(kind)
+    if check is None:
+        return True
+    try:
+        check(doc, current_user)
+    except HTTPException:
+        return False
+    return True
+
+async def find_requests_by_ids(kind: str, ids: List[str], projection: Dict[str, Any]) -> List[dict]:
+    # یک کوئری $in روی مجموعه اصلی و برای شناسه‌های پیدانشده یک کوئری به ازای هر مجموعه بایگانی
+    collection = WORKFLOW_COLLECTIONS[kind][0]
+    docs = await db[collection].find({"id": {"$in": ids}}, projection).to_list(len(ids))
+    missing = list(set(ids) - {doc['id'] for doc in docs})
+    if missing:
+        archived: Dict[str, List[str]] = {}
+        async for tombstone in db.tombstones.find(
+            {"collection": collection, "id": {"$in": missing}, "archived_to": {"$exists": True}},
+            {"_id": 0, "id": 1, "archived_to": 1}
+        ):
+            archived.setdefault(tombstone['archived_to'], []).append(tombstone['id'])
+        for name, archived_ids in archived.items():
+            docs.extend(await db[name].find({"id": {"$in": archived_ids}}, projection).to_list(len(archived_ids)))
+    return docs
+
+@api_router.post("/batch/get")
+async def batch_get(
+    batch: Dict[str, List[str]],
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    unknown = sorted(set(batch) - set(WORKFLOW_COLLECTIONS))
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown collections: {', '.join(unknown)}")
+    if any(len(ids) > MAX_BATCH_SIZE for ids in batch.values()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_SIZE} ids per collection")
+    
+    # بدون fields فیلدهای خلاصه (مثل لیست‌ها) برگردانده می‌شود؛ هر فیلد باید حداقل برای یکی از انواع معتبر باشد
+    requested = {name.strip() for name in (fields or "").split(",") if name.strip()}
+    if fields is not None:
+        if not requested:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="fields must not be empty")
+        unknown = sorted(requested - set().union(*(SELECTABLE_FIELDS[kind] for kind in batch)))
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    result = {"missing": {}}
+    for kind, ids in batch.items():
+        ids = list(dict.fromkeys(ids))
+        if fields is None:
+            projection = None
+            query_projection = SUMMARY_PROJECTIONS[kind]
+        else:
+            projection = field_projection(kind, ",".join(sorted(requested & SELECTABLE_FIELDS[kind])) or "id")
+            query_projection = with_fields(projection, "requester_id")
+        docs = await find_requests_by_ids(kind, ids, query_projection) if ids else []
+        # شناسه‌های بدون دسترسی مانند شناسه‌های ناموجود گزارش می‌شوند
+        found = {doc['id']: select_fields(doc, projection) for doc in docs if can_access(kind, doc, current_user)}
+        result[kind] = found
+        result["missing"][kind] = [entity_id for entity_id in ids if entity_id not in found]
+    return result
+
+# Search
+@api_router.get("/search")
+async def search_requests(
+    q: str,
+    kind: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=50),
+    current_user: dict = Depends(get_current_user)
+):
+    if kind and kind not in WORKFLOW_COLLECTIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid kind")
+    
+    text = normalize_query(q)
+    if not text:
+        return {"results": [], "page": page, "page_size": page_size}
+    
+    visibility = []
+    for name, (_, scope_query) in WORKFLOW_COLLECTIONS.items():
+        if kind and name != kind:
+            continue
+        clause = {"kind": name}
+        if scope_query(current_user):
+            clause['owner_id'] = current_user['user_id']
+        visibility.append(clause)
+    
+    score = {"$meta": "textScore"}
+    hits = await db.search_index.find(
+        {"$text": {"$search": text, "$language": "none"}, "$or": visibility},
+        {"_id": 0, "kind": 1, "entity_id": 1, "score": score}
+    ).sort([("score", score)]).skip((page - 1) * page_size).limit(page_size).to_list(page_size)
+    
+    summaries = {}
+    for name in WORKFLOW_COLLECTIONS:
+        ids = [hit['entity_id'] for hit in hits if hit['kind'] == name]
+        if ids:
+            # درخواست‌های بایگانی‌شده هم در ایندکس جستجو می‌مانند و از طریق تومب‌استون پیدا می‌شوند
+            docs = await find_requests_by_ids(name, ids, SUMMARY_PROJECTIONS[name])
+            summaries.update({(name, doc['id']): doc for doc in docs})
+    
+    results = []
+    for hit in hits:
+        summary = summaries.get((hit['kind'], hit['entity_id']))
+        if summary:
+            results.append({"kind": hit['kind'], "score": hit['score'], **summary})
+    return {"results": results, "page": page, "page_size": page_size}
+
+@api_router.post("/admin/search/reindex")
+async def reindex_search(current_user: dict = Depends(get_current_user)):
+    if UserRole.ADMIN not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    indexed = await rebuild_search_index()
+    return {"message": "Search index rebuilt", "indexed": indexed}
+
+# Inbox
+# وضعیت‌هایی که هر نقش باید روی آن‌ها اقدام کند
+INBOX_ROLE_STATUSES = {
+    "goods": {
+        UserRole.PROCUREMENT: [
+            RequestStatus.PENDING_PROCUREMENT, RequestStatus.PENDING_PURCHASE,
+            RequestStatus.PENDING_RECEIPT, RequestStatus.PENDING_INVOICE
+        ],
+        UserRole.MANAGEMENT: [RequestStatus.PENDING_MANAGEMENT],
+        UserRole.FINANCIAL: [RequestStatus.PENDING_FINANCIAL],
+    },
+    "payment": {
+        UserRole.FINANCIAL: [PaymentRequestStatus.PENDING_FINANCIAL, PaymentRequestStatus.PENDING_PAYMENT],
+        UserRole.DEV_MANAGER: [PaymentRequestStatus.PENDING_DEV_MANAGER],
+    },
+    "proposal": {
+        UserRole.COO: [ProposalStatus.PENDING_COO],
+        UserRole.DEV_MANAGER: [ProposalStatus.PENDING_DEV_MANAGER],
+        UserRole.PROJECT_CONTROL: [ProposalStatus.PENDING_PROJECT_CONTROL],
+    },
+}
+
+# کارهایی که صاحب درخواست باید انجام دهد (ویرایش پیش‌نویس، تایید رسید)
+INBOX_OWNER_STATUSES = {
+    "goods": [RequestStatus.DRAFT, RequestStatus.PENDING_RECEIPT],
+    "payment": [PaymentRequestStatus.DRAFT],
+    "proposal": [ProposalStatus.DRAFT],
+}
+
+INBOX_FIELDS = {
+    "goods": {"number": "$request_number", "title": "$item_name", "requester_name": "$requester_name"},
+    "payment": {"number": "$request_number", "title": "$request_type", "requester_name": "$requester_name"},
+    "proposal": {"number": "$proposal_number", "title": "$title", "requester_name": "$proposer_name"},
+}
+
+def _inbox_branch(kind: str, current_user: dict) -> List[Dict[str, Any]]:
+    user_roles = current_user.get('roles', [])
+    role_statuses = []
+    for role, statuses in INBOX_ROLE_STATUSES[kind].items():
+        if role in user_roles:
+            role_statuses.extend(statuses)
+    
+    conditions = [{OWNER_FIELDS[kind]: current_user['user_id'], "status": {"$in": INBOX_OWNER_STATUSES[kind]}}]
+    if role_statuses:
+        conditions.append({"status": {"$in": role_statuses}})
+    
+    return [
+        {"$match": {"$or": conditions}},
+        {"$project": {
+            "_id": 0,
+            "kind": {"$literal": kind},
+            "id": 1,
+            "status": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            **INBOX_FIELDS[kind]
+        }}
+    ]
+
+@api_router.get("/inbox")
+async def get_inbox(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    pipeline = _inbox_branch("goods", current_user)
+    for kind in ("payment", "proposal"):
+        pipeline.append({"$unionWith": {
+            "coll": WORKFLOW_COLLECTIONS[kind][0],
+            "pipeline": _inbox_branch(kind, current_user)
+        }})
+    # قدیمی‌ترین کار در ابتدای صف
+    pipeline.append({"$sort": {"updated_at": 1, "id": 1}})
+    pipeline.append({"$facet": {
+        "items": [{"$skip": (page - 1) * page_size}, {"$limit": page_size}],
+        "total": [{"$count": "count"}]
+    }})
+    
+    result = await db.goods_requests.aggregate(pipeline).to_list(1)
+    facet = result[0] if result else {"items": [], "total": []}
+    total = facet['total'][0]['count'] if facet['total'] else 0
+    return {"items": facet['items'], "total": total, "page": page, "page_size": page_size}
+
+# Analytics
+ANALYTICS_ROLES = [UserRole.ADMIN, UserRole.MANAGEMENT, UserRole.COO, UserRole.DEV_MANAGER]
+ANALYTICS_BATCH_SIZE = 1000
+
+ANALYTICS_PROJECTIONS = {
+    "goods": {"_id": 0, "id": 1, "revision": 1, "cost_center": 1, "history": 1},
+    "payment": {"_id": 0, "id": 1, "revision": 1, "payment_row.cost_center": 1, "history": 1},
+    "proposal": {"_id": 0, "id": 1, "revision": 1, "history": 1},
+}
+
+stage_durations = StageDurationStore()
+stage_durations_lock = asyncio.Lock()
+
+async def refresh_stage_durations(workflow: str):
+    # فقط اسنادی که بعد از آخرین بارگذاری تغییر کرده‌اند خوانده می‌شوند. revision پیش از ثبت رزرو می‌شود
+    # و خواندن از secondary است، پس واترمارک تا revision قطعی (با احتساب عقب‌ماندگی secondary) جلو می‌رود.
+    async with stage_durations_lock:
+        collection = WORKFLOW_COLLECTIONS[workflow][0]
+        settled = await settled_revision(reporting_lag())
+        watermark = stage_durations.watermarks[workflow]
+        # بارگذاری اول اسناد بایگانی‌شده را هم می‌خواند تا پاسخ همه workerها یکسان باشد
+        sources = [collection, *(await all_archive_collections(collection))] if watermark == 0 else [collection]
+        for source in sources:
+            cursor = reporting_db[source].find(
+                {"revision": {"$gt": watermark}},
+                ANALYTICS_PROJECTIONS[workflow]
+            ).batch_size(ANALYTICS_BATCH_SIZE)
+            batch = []
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) == ANALYTICS_BATCH_SIZE:
+                    await run_in_threadpool(stage_durations.apply, workflow, batch)
+                    batch = []
+            await run_in_threadpool(stage_durations.apply, workflow, batch)
+        stage_durations.advance(workflow, settled)
+
+@api_router.get("/analytics/stage-durations")
+async def get_stage_durations(
+    workflow: str = "goods",
+    group_by: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    if not any(role in current_user.get('roles', []) for role in ANALYTICS_ROLES):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    if workflow not in WORKFLOWS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid workflow")
+    if group_by and group_by not in GROUP_BY_COLUMNS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid group_by")
+    
+    start, end = parse_date_window(date_from, date_to)
+    
+    await refresh_stage_durations(workflow)
+    return {
+        "workflow": workflow,
+        "group_by": group_by,
+        "from": start,
+        "to": end,
+        "stages": stage_durations.summary(workflow, group_by, start, end)
+    }
+
+# Price history
+PRICE_HISTORY_ROLES = [UserRole.ADMIN, UserRole.MANAGEMENT, UserRole.PROCUREMENT, UserRole.COO]
+# آمار روی جدیدترین مشاهدات هر کالا محاسبه می‌شود
+PRICE_HISTORY_WINDOW = 500
+
+async def price_history(key: str, query: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    cursor = db.price_observations.find({"item_key": key, **query}, {"_id": 0}).sort("observed_at", -1)
+    observations = (await cursor.to_list(PRICE_HISTORY_WINDOW))[::-1]
+    return {
+        "item_key": key,
+        "stats": price_stats(observations),
+        "by_source": {
+            source: price_stats([doc for doc in observations if doc['source'] == source]) for source in PRICE_SOURCES
+        },
+        "observations": observations[::-1][:limit],
+    }
+
+def price_history_filter(
+    source: Optional[str], date_from: Optional[str], date_to: Optional[str]
+) -> Dict[str, Any]:
+    if source and source not in PRICE_SOURCES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid source")
+    start, end = parse_date_window(date_from, date_to)
+    query = date_range("observed_at", gte=start, lt=end)
+    if source:
+        query["source"] = source
+    return query
+
+@api_router.get("/price-history")
+async def get_price_history(
+    item: str,
+    source: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(20, ge=0, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    if not any(role in current_user.get('roles', []) for role in PRICE_HISTORY_ROLES):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    key = item_key(item)
+    if not key:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty item")
+    
+    return {"item": item, **(await price_history(key, price_history_filter(source, date_from, date_to), limit))}
+
+@api_router.get("/goods-requests/{request_id}/price-history")
+async def get_request_price_history(
+    request_id: str,
+    source: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(20, ge=0, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    # سابقه قیمت کالای این درخواست بدون استعلام‌ها و رسیدهای خود آن، برای مقایسه استعلام‌ها
+    if not any(role in current_user.get('roles', []) for role in PRICE_HISTORY_ROLES):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    request = await find_request("goods", request_id, {"_id": 0, "item_name": 1})
+    if not request:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    
+    query = price_history_filter(source, date_from, date_to)
+    query["request_id"] = {"$ne": request_id}
+    return {
+        "item": request['item_name'],
+        **(await price_history(item_key(request['item_name']), query, limit))
+    }
+
 # Notifications
+NOTIFICATION_READ_RETENTION_DAYS = float(os.environ.get('NOTIFICATION_READ_RETENTION_DAYS', '30'))
+NOTIFICATION_ARCHIVE_DAYS = float(os.environ.get('NOTIFICATION_ARCHIVE_DAYS', '90'))
+NOTIFICATION_ARCHIVE_BATCH_SIZE = int(os.environ.get('NOTIFICATION_ARCHIVE_BATCH_SIZE', '1000'))
+NOTIFICATION_ARCHIVE_MAX_BATCHES = int(os.environ.get('NOTIFICATION_ARCHIVE_MAX_BATCHES', '10'))
+
 @api_router.get("/notifications")
 async def get_notifications(current_user: dict = Depends(get_current_user)):
     notifications = await db.notifications.find(
@@ -1052,9 +2156,15 @@ async def get_notifications(current_user: dict = Depends(get_current_user)):
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
+    now = datetime.now(timezone.utc)
     result = await db.notifications.update_one(
         {"id": notification_id, "user_id": current_user['user_id']},
-        {"$set": {"is_read": True}}
+        # اعلان خوانده‌شده پس از مدت نگهداری توسط ایندکس TTL حذف می‌شود
+        {"$set": {
+            "is_read": True,
+            "read_at": now,
+            "expires_at": now + timedelta(days=NOTIFICATION_READ_RETENTION_DAYS)
+        }}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
@@ -1062,7 +2172,11 @@ async def mark_notification_read(notification_id: str, current_user: dict = Depe
 
 # Reports
 @api_router.get("/reports/excel")
-async def export_excel(current_user: dict = Depends(get_current_user)):
+async def export_excel(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
     user_roles = current_user.get('roles', [])
     user_id = current_user['user_id']
     
@@ -1070,8 +2184,10 @@ async def export_excel(current_user: dict = Depends(get_current_user)):
     if UserRole.ADMIN not in user_roles and UserRole.MANAGEMENT not in user_roles:
         if UserRole.REQUESTER in user_roles:
             query['requester_id'] = user_id
+    start, end = parse_date_window(date_from, date_to)
+    query = created_between(query, start, end)
     
-    requests = await db.goods_requests.find(query, {"_id": 0}).to_list(1000)
+    requests = await find_with_archive("goods", query, start, end, database=reporting_db)
     
     wb = openpyxl.Workbook()
     ws = wb.active
@@ -1116,6 +2232,175 @@ async def export_excel(current_user: dict = Depends(get_current_user)):
         headers={"Content-Disposition": "attachment; filename=report.xlsx"}
     )
 
+# Streaming exports (CSV / NDJSON) for data-warehouse pulls
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+EXPORT_SOURCES = {
+    "goods": {
+        "collection": "goods_requests",
+        "owner_field": "requester_id",
+        "columns": [
+            "id", "request_number", "requester_id", "requester_name", "item_name", "quantity",
+            "cost_center", "need_date", "description", "status", "received_quantity",
+            "received_total_price", "created_at", "updated_at"
+        ],
+        "computed": {
+            "received_quantity": {"$sum": "$receipts.quantity"},
+            "received_total_price": {"$sum": "$receipts.total_price"},
+        },
+    },
+    "payment": {
+        "collection": "payment_requests",
+        "owner_field": "requester_id",
+        "columns": [
+            "id", "request_number", "requester_id", "requester_name", "request_type", "request_type_other",
+            "total_amount", "amount", "invoice_contract_number", "reason", "cost_center", "payment_method",
+            "bank_name", "payment_date", "status", "created_at", "updated_at"
+        ],
+        "computed": {
+            "amount": "$payment_row.amount",
+            "invoice_contract_number": "$payment_row.invoice_contract_number",
+            "reason": "$payment_row.reason",
+            "cost_center": "$payment_row.cost_center",
+            "payment_method": "$payment_row.payment_method",
+            "bank_name": "$payment_row.bank_name",
+            "payment_date": "$payment_row.payment_date",
+        },
+    },
+    "proposal": {
+        "collection": "project_proposals",
+        "owner_field": "proposer_id",
+        "columns": [
+            "id", "proposal_number", "project_code", "proposer_id", "proposer_name", "title", "project_type",
+            "feasibility_manager_id", "feasibility_manager_name", "status", "created_at", "updated_at"
+        ],
+        "computed": {},
+    },
+}
+
+EXPORT_EVENT_COLUMNS = [
+    "source", "entity_id", "entity_number", "action", "actor_id", "actor_name",
+    "from_status", "to_status", "notes", "timestamp"
+]
+
+def _export_scope(current_user: dict, owner_field: str) -> Dict[str, Any]:
+    user_roles = current_user.get('roles', [])
+    if UserRole.ADMIN in user_roles or UserRole.MANAGEMENT in user_roles:
+        return {}
+    return {owner_field: current_user['user_id']}
+
+def _export_pipeline(source: dict, match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    projection = {"_id": 0}
+    for column in source['columns']:
+        projection[column] = source['computed'].get(column, 1)
+    return [{"$match": match}, {"$sort": {"updated_at": 1}}, {"$project": projection}]
+
+def _export_event_pipeline(name: str, match: Dict[str, Any], since: Optional[datetime]) -> List[Dict[str, Any]]:
+    number_field = "$proposal_number" if name == "proposal" else "$request_number"
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, "id": 1, "number": number_field, "history": 1}},
+        {"$unwind": "$history"},
+    ]
+    if since:
+        pipeline.append({"$match": date_range("history.timestamp", gte=since)})
+    pipeline.append({"$project": {
+        "source": {"$literal": name},
+        "entity_id": "$id",
+        "entity_number": "$number",
+        "action": "$history.action",
+        "actor_id": "$history.actor_id",
+        "actor_name": "$history.actor_name",
+        "from_status": "$history.from_status",
+        "to_status": "$history.to_status",
+        "notes": "$history.notes",
+        "timestamp": "$history.timestamp",
+    }})
+    return pipeline
+
+def _export_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return as_datetime(value).isoformat()
+    return value if isinstance(value, (str, int, float)) else str(value)
+
+async def _stream_export(cursors, columns: List[str], export_format: str):
+    # هر بسته از کرسر به صورت جداگانه ارسال می‌شود تا کل نتیجه در حافظه نماند
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(columns)
+    rows = 0
+    for cursor in cursors:
+        async for doc in cursor:
+            if export_format == "csv":
+                writer.writerow([_export_value(doc.get(c)) for c in columns])
+            else:
+                buffer.write(json.dumps(doc, ensure_ascii=False, default=_export_value))
+                buffer.write("\n")
+            rows += 1
+            if rows % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+@api_router.get("/exports/{collection}.{export_format}")
+async def stream_export(
+    collection: str,
+    export_format: str,
+    updated_since: Optional[datetime] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user)
+):
+    if export_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unsupported export format")
+    if collection != "events" and collection not in EXPORT_SOURCES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown export collection")
+    
+    # با خواندن از secondary، تغییرات اخیر ممکن است هنوز نرسیده باشند؛ واترمارک به اندازه حداکثر تاخیر عقب می‌رود
+    watermark = datetime.now(timezone.utc) - reporting_lag()
+    since = as_datetime(updated_since)
+    start, end = parse_date_window(date_from, date_to)
+    
+    cursors = []
+    if collection == "events":
+        columns = EXPORT_EVENT_COLUMNS
+        for name, source in EXPORT_SOURCES.items():
+            match = created_between(_export_scope(current_user, source['owner_field']), start, end)
+            if since:
+                match = merge_filter(match, date_range("updated_at", gte=since))
+            for target in [source['collection']] + await archive_collections(source['collection'], start, end):
+                cursors.append(reporting_db[target].aggregate(
+                    _export_event_pipeline(name, match, since),
+                    batchSize=EXPORT_BATCH_SIZE
+                ))
+    else:
+        source = EXPORT_SOURCES[collection]
+        columns = source['columns']
+        match = created_between(_export_scope(current_user, source['owner_field']), start, end)
+        if since:
+            match = merge_filter(match, date_range("updated_at", gte=since))
+        for target in [source['collection']] + await archive_collections(source['collection'], start, end):
+            cursors.append(reporting_db[target].aggregate(
+                _export_pipeline(source, match),
+                batchSize=EXPORT_BATCH_SIZE,
+                allowDiskUse=True
+            ))
+    
+    media_type = "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _stream_export(cursors, columns, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={collection}.{export_format}",
+            "X-Export-Watermark": watermark.isoformat()
+        }
+    )
+
 # ==================== Project Proposal Endpoints ====================
 @api_router.post("/project-proposals")
 async def create_project_proposal(proposal_data: ProjectProposalCreate, current_user: dict = Depends(get_current_user)):
@@ -1140,36 +2425,48 @@ async def create_project_proposal(proposal_data: ProjectProposalCreate, current_
     )
     
     doc = proposal.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    for i, hist in enumerate(doc['history']):
-        doc['history'][i]['timestamp'] = hist['timestamp'].isoformat()
     
+    doc['revision'] = await next_revision()
     await db.project_proposals.insert_one(doc)
+    await index_for_search("proposal", doc)
     
     return {"message": "Proposal created", "proposal_id": proposal.id, "proposal_number": proposal_number}
 
 @api_router.get("/project-proposals")
-async def get_project_proposals(current_user: dict = Depends(get_current_user)):
-    user_roles = current_user.get('roles', [])
-    user_id = current_user['user_id']
-    
-    query = {}
-    if UserRole.ADMIN not in user_roles:
-        special_roles = [UserRole.COO, UserRole.DEV_MANAGER, UserRole.PROJECT_CONTROL]
-        has_special_role = any(role in user_roles for role in special_roles)
-        if not has_special_role:
-            query['proposer_id'] = user_id
-    
-    proposals = await db.project_proposals.find(query, {"_id": 0}).to_list(1000)
+async def get_project_proposals(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("proposal", fields)
+    start, end = parse_date_window(date_from, date_to)
+    query = created_between(proposal_scope_query(current_user), start, end)
+    proposals = await find_with_archive("proposal", query, start, end, projection)
     return proposals
 
 @api_router.get("/project-proposals/{proposal_id}")
-async def get_project_proposal(proposal_id: str, current_user: dict = Depends(get_current_user)):
-    proposal = await db.project_proposals.find_one({"id": proposal_id}, {"_id": 0})
+async def get_project_proposal(
+    proposal_id: str,
+    response: Response,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("proposal", fields)
+    if if_none_match:
+        meta = await find_request("proposal", proposal_id, {"_id": 0, "revision": 1})
+        if not meta:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        etag = make_etag("proposal", meta.get('revision'), projection)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    proposal = await find_request("proposal", proposal_id, with_fields(projection, "revision"))
     if not proposal:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return proposal
+    set_etag(response, make_etag("proposal", proposal.get('revision'), projection))
+    return select_fields(proposal, projection)
 
 @api_router.put("/project-proposals/{proposal_id}")
 async def update_project_proposal(proposal_id: str, proposal_data: ProjectProposalUpdate, current_user: dict = Depends(get_current_user)):
@@ -1183,7 +2480,7 @@ async def update_project_proposal(proposal_id: str, proposal_data: ProjectPropos
     if proposal['status'] != ProposalStatus.DRAFT:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Can only edit draft proposals")
     
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = await revision_stamp()
     if proposal_data.title:
         update_data['title'] = proposal_data.title
     if proposal_data.objective:
@@ -1196,6 +2493,7 @@ async def update_project_proposal(proposal_id: str, proposal_data: ProjectPropos
         update_data['documents'] = proposal_data.documents
     
     await db.project_proposals.update_one({"id": proposal_id}, {"$set": update_data})
+    await index_for_search("proposal", {**proposal, **update_data})
     return {"message": "Proposal updated"}
 
 @api_router.post("/project-proposals/{proposal_id}/submit")
@@ -1223,18 +2521,15 @@ async def submit_proposal(proposal_id: str, current_user: dict = Depends(get_cur
         {
             "$set": {
                 "status": ProposalStatus.PENDING_COO,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {
-                "history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }
+                "history": history_entry.model_dump()
             }
         }
     )
     
-    coo_users = await db.users.find({"roles": UserRole.COO}).to_list(100)
+    coo_users = await get_users_with_role(UserRole.COO)
     for user in coo_users:
         await create_notification(
             user['id'],
@@ -1273,20 +2568,17 @@ async def coo_review_proposal(proposal_id: str, review: COOReview, current_user:
                 "$set": {
                     "is_aligned": True,
                     "coo_notes": review.notes,
-                    "coo_reviewed_at": datetime.now(timezone.utc).isoformat(),
+                    "coo_reviewed_at": datetime.now(timezone.utc),
                     "status": ProposalStatus.PENDING_DEV_MANAGER,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    **(await revision_stamp())
                 },
                 "$push": {
-                    "history": {
-                        **history_entry.model_dump(),
-                        "timestamp": history_entry.timestamp.isoformat()
-                    }
+                    "history": history_entry.model_dump()
                 }
             }
         )
         
-        dev_managers = await db.users.find({"roles": UserRole.DEV_MANAGER}).to_list(100)
+        dev_managers = await get_users_with_role(UserRole.DEV_MANAGER)
         for user in dev_managers:
             await create_notification(
                 user['id'],
@@ -1312,15 +2604,12 @@ async def coo_review_proposal(proposal_id: str, review: COOReview, current_user:
                 "$set": {
                     "is_aligned": False,
                     "coo_notes": review.notes,
-                    "coo_reviewed_at": datetime.now(timezone.utc).isoformat(),
+                    "coo_reviewed_at": datetime.now(timezone.utc),
                     "status": ProposalStatus.REJECTED_BY_COO,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    **(await revision_stamp())
                 },
                 "$push": {
-                    "history": {
-                        **history_entry.model_dump(),
-                        "timestamp": history_entry.timestamp.isoformat()
-                    }
+                    "history": history_entry.model_dump()
                 }
             }
         )
@@ -1362,20 +2651,22 @@ async def assign_feasibility_manager(proposal_id: str, assignment: AssignFeasibi
                 "feasibility_manager_id": assignment.feasibility_manager_id,
                 "feasibility_manager_name": assignment.feasibility_manager_name,
                 "dev_manager_notes": assignment.notes,
-                "dev_manager_assigned_at": datetime.now(timezone.utc).isoformat(),
+                "dev_manager_assigned_at": datetime.now(timezone.utc),
                 "status": ProposalStatus.PENDING_PROJECT_CONTROL,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {
-                "history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }
+                "history": history_entry.model_dump()
             }
         }
     )
     
-    control_users = await db.users.find({"roles": UserRole.PROJECT_CONTROL}).to_list(100)
+    await index_for_search("proposal", {
+        **proposal,
+        "feasibility_manager_name": assignment.feasibility_manager_name
+    })
+    
+    control_users = await get_users_with_role(UserRole.PROJECT_CONTROL)
     for user in control_users:
         await create_notification(
             user['id'],
@@ -1414,19 +2705,18 @@ async def register_project(proposal_id: str, registration: RegisterProject, curr
                 "project_code": registration.project_code,
                 "project_start_date": registration.project_start_date,
                 "control_notes": registration.notes,
-                "registered_at": datetime.now(timezone.utc).isoformat(),
+                "registered_at": datetime.now(timezone.utc),
                 "status": ProposalStatus.COMPLETED,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {
-                "history": {
-                    **history_entry.model_dump(),
-                    "timestamp": history_entry.timestamp.isoformat()
-                }
+                "history": history_entry.model_dump()
             }
         }
     )
     
+    await index_for_search("proposal", {**proposal, "project_code": registration.project_code})
+    
     if proposal.get('feasibility_manager_id'):
         await create_notification(
             proposal['feasibility_manager_id'],
@@ -1447,17 +2737,7 @@ async def register_project(proposal_id: str, registration: RegisterProject, curr
 # ==================== Payment Request Endpoints ====================
 async def get_next_payment_number() -> str:
     current_year = 1404
-    counter_doc = await db.counters.find_one({"type": "payment_number", "year": current_year})
-    if not counter_doc:
-        await db.counters.insert_one({"type": "payment_number", "year": current_year, "counter": 1})
-        return f"PAY-{current_year}-1"
-    else:
-        new_counter = counter_doc['counter'] + 1
-        await db.counters.update_one(
-            {"type": "payment_number", "year": current_year},
-            {"$set": {"counter": new_counter}}
-        )
-        return f"PAY-{current_year}-{new_counter}"
+    return f"PAY-{current_year}-{await increment_counter({'type': 'payment_number', 'year': current_year})}"
 
 @api_router.post("/payment-requests")
 async def create_payment_request(request_data: PaymentRequestCreate, current_user: dict = Depends(get_current_user)):
@@ -1496,36 +2776,48 @@ async def create_payment_request(request_data: PaymentRequestCreate, current_use
     )
     
     doc = payment_request.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    for i, hist in enumerate(doc['history']):
-        doc['history'][i]['timestamp'] = hist['timestamp'].isoformat()
     
+    doc['revision'] = await next_revision()
     await db.payment_requests.insert_one(doc)
+    await index_for_search("payment", doc)
     
     return {"message": "Payment request created", "request_id": payment_request.id, "request_number": payment_number}
 
 @api_router.get("/payment-requests")
-async def get_payment_requests(current_user: dict = Depends(get_current_user)):
-    user_roles = current_user.get('roles', [])
-    user_id = current_user['user_id']
-    
-    query = {}
-    if UserRole.ADMIN not in user_roles:
-        special_roles = [UserRole.FINANCIAL, UserRole.DEV_MANAGER]
-        has_special_role = any(role in user_roles for role in special_roles)
-        if not has_special_role:
-            query['requester_id'] = user_id
-    
-    requests = await db.payment_requests.find(query, {"_id": 0}).to_list(1000)
+async def get_payment_requests(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("payment", fields)
+    start, end = parse_date_window(date_from, date_to)
+    query = created_between(payment_scope_query(current_user), start, end)
+    requests = await find_with_archive("payment", query, start, end, projection)
     return requests
 
 @api_router.get("/payment-requests/{request_id}")
-async def get_payment_request(request_id: str, current_user: dict = Depends(get_current_user)):
-    request = await db.payment_requests.find_one({"id": request_id}, {"_id": 0})
+async def get_payment_request(
+    request_id: str,
+    response: Response,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = field_projection("payment", fields)
+    if if_none_match:
+        meta = await find_request("payment", request_id, {"_id": 0, "revision": 1})
+        if not meta:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        etag = make_etag("payment", meta.get('revision'), projection)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    request = await find_request("payment", request_id, with_fields(projection, "revision"))
     if not request:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return request
+    set_etag(response, make_etag("payment", request.get('revision'), projection))
+    return select_fields(request, projection)
 
 @api_router.put("/payment-requests/{request_id}")
 async def update_payment_request(request_id: str, request_data: PaymentRequestCreate, current_user: dict = Depends(get_current_user)):
@@ -1564,9 +2856,14 @@ async def update_payment_request(request_id: str, request_data: PaymentRequestCr
             "total_amount": request_data.total_amount,
             "payment_row": payment_row,
             "attachment_base64": request_data.attachment_base64,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            **(await revision_stamp())
         }}
     )
+    await index_for_search("payment", {
+        **request,
+        "request_type_other": request_data.request_type_other,
+        "payment_row": payment_row
+    })
     return {"message": "Payment request updated"}
 
 @api_router.post("/payment-requests/{request_id}/submit")
@@ -1585,7 +2882,7 @@ async def submit_payment_request(request_id: str, current_user: dict = Depends(g
         "action": "submitted",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     }
     
     await db.payment_requests.update_one(
@@ -1593,14 +2890,14 @@ async def submit_payment_request(request_id: str, current_user: dict = Depends(g
         {
             "$set": {
                 "status": PaymentRequestStatus.PENDING_FINANCIAL,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
     )
     
     # Notify financial users
-    financial_users = await db.users.find({"roles": UserRole.FINANCIAL}).to_list(100)
+    financial_users = await get_users_with_role(UserRole.FINANCIAL)
     for user in financial_users:
         await create_notification(
             user['id'],
@@ -1627,7 +2924,7 @@ async def review_financial(request_id: str, data: ActionRequest, current_user: d
         "action": "reviewed_by_financial",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "notes": data.notes or "بررسی شد توسط واحد مالی"
     }
     
@@ -1636,14 +2933,14 @@ async def review_financial(request_id: str, data: ActionRequest, current_user: d
         {
             "$set": {
                 "status": PaymentRequestStatus.PENDING_DEV_MANAGER,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
     )
     
     # Notify dev manager users
-    dev_manager_users = await db.users.find({"roles": UserRole.DEV_MANAGER}).to_list(100)
+    dev_manager_users = await get_users_with_role(UserRole.DEV_MANAGER)
     for user in dev_manager_users:
         await create_notification(
             user['id'],
@@ -1673,7 +2970,7 @@ async def reject_financial(request_id: str, data: ActionRequest, current_user: d
         "action": "rejected_by_financial",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "notes": data.notes
     }
     
@@ -1682,7 +2979,7 @@ async def reject_financial(request_id: str, data: ActionRequest, current_user: d
         {
             "$set": {
                 "status": PaymentRequestStatus.DRAFT,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
@@ -1714,7 +3011,7 @@ async def approve_payment_dev_manager(request_id: str, action: ActionRequest, cu
         "action": "approved_by_dev_manager",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "notes": action.notes or "تایید شد توسط مدیر توسعه"
     }
     
@@ -1723,14 +3020,14 @@ async def approve_payment_dev_manager(request_id: str, action: ActionRequest, cu
         {
             "$set": {
                 "status": PaymentRequestStatus.PENDING_PAYMENT,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
     )
     
     # Notify financial users for final payment
-    financial_users = await db.users.find({"roles": UserRole.FINANCIAL}).to_list(100)
+    financial_users = await get_users_with_role(UserRole.FINANCIAL)
     for user in financial_users:
         await create_notification(
             user['id'],
@@ -1757,7 +3054,7 @@ async def reject_payment_dev_manager(request_id: str, action: ActionRequest, cur
         "action": "rejected_by_dev_manager",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "notes": action.notes or "رد شد"
     }
     
@@ -1766,7 +3063,7 @@ async def reject_payment_dev_manager(request_id: str, action: ActionRequest, cur
         {
             "$set": {
                 "status": PaymentRequestStatus.REJECTED,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
@@ -1787,6 +3084,46 @@ class FinalPaymentData(BaseModel):
     invoice_base64: Optional[str] = None
     notes: Optional[str] = None
 
+class BatchPaymentData(BaseModel):
+    request_ids: List[str]
+    payment_date: str
+    notes: Optional[str] = None
+
+@api_router.post("/payment-requests/batch/process-payment")
+async def batch_process_payment(batch: BatchPaymentData, current_user: dict = Depends(get_current_user)):
+    if UserRole.FINANCIAL not in current_user.get('roles', []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    
+    history_entry = {
+        "action": "completed",
+        "actor_id": current_user['user_id'],
+        "actor_name": current_user['full_name'],
+        "timestamp": datetime.now(timezone.utc),
+        "notes": batch.notes or "پرداخت انجام شد"
+    }
+    
+    def build_update(doc, stamp):
+        update_fields = {"status": PaymentRequestStatus.COMPLETED, **stamp}
+        if doc.get('payment_row'):
+            update_fields['payment_row.payment_date'] = batch.payment_date
+        return {"$set": update_fields, "$push": {"history": history_entry}}
+    
+    results, applied = await apply_batch_transition(
+        "payment_requests",
+        batch.request_ids,
+        PaymentRequestStatus.PENDING_PAYMENT,
+        build_update,
+        projection={"payment_row": 1}
+    )
+    
+    await create_coalesced_notifications(
+        group_by_requester(applied),
+        lambda item: f"درخواست پرداخت {item['request_number']} تکمیل شد",
+        lambda items: f"{len(items)} درخواست پرداخت شما تکمیل شد: {'، '.join(i['request_number'] for i in items)}"
+    )
+    
+    return {"results": results, "applied": len(applied)}
+
 @api_router.post("/payment-requests/{request_id}/process-payment")
 async def process_payment(request_id: str, data: FinalPaymentData, current_user: dict = Depends(get_current_user)):
     if UserRole.FINANCIAL not in current_user.get('roles', []):
@@ -1808,7 +3145,7 @@ async def process_payment(request_id: str, data: FinalPaymentData, current_user:
         "action": "completed",
         "actor_id": current_user['user_id'],
         "actor_name": current_user['full_name'],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "notes": data.notes or "پرداخت انجام شد"
     }
     
@@ -1819,7 +3156,7 @@ async def process_payment(request_id: str, data: FinalPaymentData, current_user:
                 "payment_row": payment_row,
                 "invoice_base64": data.invoice_base64,
                 "status": PaymentRequestStatus.COMPLETED,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                **(await revision_stamp())
             },
             "$push": {"history": history_entry}
         }
@@ -1835,6 +3172,176 @@ async def process_payment(request_id: str, data: FinalPaymentData, current_user:
     
     return {"message": "Payment completed"}
 
+# ==================== Scheduled jobs ====================
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_INTERVAL = float(os.environ.get('SCHEDULER_INTERVAL', '300'))
+REMINDER_REPEAT_HOURS = float(os.environ.get('REMINDER_REPEAT_HOURS', '24'))
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', '500'))
+
+def parse_reminder_thresholds(value: str) -> Dict[str, float]:
+    # قالب: pending_management=72,pending_dev_manager=48 (ساعت)
+    thresholds = {}
+    for item in value.split(','):
+        if '=' in item:
+            key, hours = item.split('=', 1)
+            thresholds[key.strip()] = float(hours)
+    return thresholds
+
+REMINDER_THRESHOLDS = parse_reminder_thresholds(os.environ.get(
+    'REMINDER_THRESHOLDS',
+    'pending_procurement=72,pending_management=72,pending_purchase=120,pending_financial=72,'
+    'pending_dev_manager=72,pending_payment=72,pending_coo=72,pending_project_control=72'
+))
+
+scheduler = LeaderScheduler(db.scheduler_locks, "workflow-jobs", SCHEDULER_INTERVAL, lease=SCHEDULER_INTERVAL * 3)
+
+async def insert_reminders(docs: List[dict]):
+    if not docs:
+        return
+    try:
+        await db.notifications.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # اجرای همزمان دو worker؛ یادآوری‌های تکراری توسط ایندکس یکتا رد می‌شوند
+        if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+            raise
+
+async def remind_batch(
+    kind: str,
+    number_field: str,
+    items: List[dict],
+    recipients: List[dict],
+    threshold: timedelta,
+    repeat: timedelta,
+    now: datetime
+):
+    # در هر بازه تکرار حداکثر یک یادآوری برای هر مورد؛ موارد یادآوری‌شده در همین دور کنار گذاشته می‌شوند
+    if not items or not recipients:
+        return
+    rounds = {}
+    for item in items:
+        waiting = now - as_datetime(item['updated_at'])
+        key = f"reminder:{kind}:{item['id']}:{item.get('revision')}:{int((waiting - threshold) / repeat)}"
+        rounds[key] = (item, waiting)
+    sent = {doc['_id'] async for doc in db.reminder_rounds.find({"_id": {"$in": list(rounds)}}, {"_id": 1})}
+    pending = {key: value for key, value in rounds.items() if key not in sent}
+    if not pending:
+        return
+    
+    docs = []
+    for key, (item, waiting) in pending.items():
+        for user in recipients:
+            notification = Notification(
+                user_id=user['id'],
+                request_id=item['id'],
+                request_number=item[number_field],
+                message=f"یادآوری: درخواست {item[number_field]} بیش از {int(waiting.total_seconds() // 3600)} ساعت منتظر اقدام شماست"
+            )
+            doc = notification.model_dump()
+            doc['dedup_key'] = f"{key}:{user['id']}"
+            docs.append(doc)
+    await insert_reminders(docs)
+    await db.reminder_rounds.bulk_write([
+        UpdateOne({"_id": key}, {"$setOnInsert": {"expires_at": now + repeat}}, upsert=True) for key in pending
+    ], ordered=False)
+
+async def send_stale_reminders():
+    now = datetime.now(timezone.utc)
+    repeat = timedelta(hours=REMINDER_REPEAT_HOURS)
+    for kind, role_statuses in INBOX_ROLE_STATUSES.items():
+        collection = WORKFLOW_COLLECTIONS[kind][0]
+        number_field = "proposal_number" if kind == "proposal" else "request_number"
+        for role, statuses in role_statuses.items():
+            recipients = await get_users_with_role(role)
+            for request_status in statuses:
+                hours = REMINDER_THRESHOLDS.get(request_status.value)
+                if hours is None:
+                    continue
+                threshold = timedelta(hours=hours)
+                # از ایندکس (status, updated_at) استفاده می‌کند؛ همه موارد معوق دسته‌به‌دسته خوانده می‌شوند
+                cursor = db[collection].find(
+                    {"status": request_status, **date_range("updated_at", lt=now - threshold)},
+                    {"_id": 0, "id": 1, number_field: 1, "updated_at": 1, "revision": 1}
+                ).sort("updated_at", 1).batch_size(REMINDER_BATCH_SIZE)
+                batch = []
+                async for item in cursor:
+                    batch.append(item)
+                    if len(batch) == REMINDER_BATCH_SIZE:
+                        await remind_batch(kind, number_field, batch, recipients, threshold, repeat, now)
+                        batch = []
+                await remind_batch(kind, number_field, batch, recipients, threshold, repeat, now)
+
+async def archive_notifications():
+    now = datetime.now(timezone.utc)
+    # اعلان‌های خوانده‌شده قدیمی که قبل از TTL ثبت شده‌اند تاریخ انقضا می‌گیرند
+    await db.notifications.update_many(
+        {"is_read": True, "expires_at": {"$exists": False}},
+        {"$set": {"expires_at": now + timedelta(days=NOTIFICATION_READ_RETENTION_DAYS)}}
+    )
+    
+    cutoff = now - timedelta(days=NOTIFICATION_ARCHIVE_DAYS)
+    query = {"is_read": False, **date_range("created_at", lt=cutoff)}
+    for _ in range(NOTIFICATION_ARCHIVE_MAX_BATCHES):
+        batch = await db.notifications.find(query).limit(NOTIFICATION_ARCHIVE_BATCH_SIZE).to_list(NOTIFICATION_ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        try:
+            await db.notifications_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # اسنادی که در اجرای ناتمام قبلی منتقل شده‌اند
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+        await db.notifications.delete_many({"_id": {"$in": [doc['_id'] for doc in batch]}})
+        if len(batch) < NOTIFICATION_ARCHIVE_BATCH_SIZE:
+            break
+
+# مجموعه‌های بایگانی که ایندکس‌های آن‌ها در این فرایند ساخته شده است
+indexed_archives = set()
+
+async def ensure_archive_indexes(target: str):
+    if target in indexed_archives:
+        return
+    await db[target].create_index("id", unique=True)
+    await db[target].create_index("created_at")
+    indexed_archives.add(target)
+
+async def archive_terminal_requests():
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    for kind, (collection, _) in WORKFLOW_COLLECTIONS.items():
+        terminal = {"status": {"$in": TERMINAL_STATUSES[kind]}}
+        query = {**terminal, **date_range("updated_at", lt=cutoff)}
+        for _ in range(ARCHIVE_MAX_BATCHES):
+            batch = await db[collection].find(query).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            by_year: Dict[int, List[dict]] = {}
+            for doc in batch:
+                by_year.setdefault(jalali_year(doc['created_at']), []).append(doc)
+            
+            for year, docs in by_year.items():
+                target = archive_collection_name(collection, year)
+                await ensure_archive_indexes(target)
+                try:
+                    await db[target].insert_many(docs, ordered=False)
+                except BulkWriteError as e:
+                    # اسنادی که در اجرای ناتمام قبلی منتقل شده‌اند
+                    if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                        raise
+                # تومب‌استون قبل از حذف ثبت می‌شود تا جزئیات درخواست همیشه پیدا شود
+                await record_tombstones(kind, docs, archived_to=target)
+            
+            await db[collection].delete_many({"_id": {"$in": [doc['_id'] for doc in batch]}, **terminal})
+            if len(batch) < ARCHIVE_BATCH_SIZE:
+                break
+
+scheduler.add_job("stale-reminders", send_stale_reminders)
+scheduler.add_job("notification-archive", archive_notifications)
+scheduler.add_job("request-archive", archive_terminal_requests)
+
+@app.on_event("startup")
+async def start_scheduler():
+    if SCHEDULER_ENABLED:
+        background_tasks.append(asyncio.create_task(scheduler.run()))
+
 # Initialize admin user
 @app.on_event("startup")
 async def initialize_admin():
@@ -1846,13 +3353,188 @@ async def initialize_admin():
             password_hash=hash_password("admin123"),
             roles=[UserRole.ADMIN]
         )
-        doc = admin.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.users.insert_one(doc)
+        await db.users.insert_one(admin.model_dump())
+        await bump_collection_revision("users")
         logging.info("Admin user created: username=admin, password=admin123")
 
+async def create_unique_index(collection: str, keys, **kwargs) -> bool:
+    # پایگاه‌های داده قدیمی ممکن است مقادیر تکراری داشته باشند؛ خطای ساخت ایندکس نباید جلوی شروع برنامه را بگیرد
+    try:
+        await db[collection].create_index(keys, unique=True, **kwargs)
+    except OperationFailure as e:
+        logging.error("Unique index %s on %s not created, remove duplicates first: %s", keys, collection, e)
+        return False
+    return True
+
+@app.on_event("startup")
+async def seed_cost_centers():
+    # همه workerها همزمان این را اجرا می‌کنند؛ upsert روی ایندکس یکتای name مانع درج تکراری است
+    await create_unique_index("cost_centers", "name")
+    if await db.cost_centers.count_documents({}, limit=1):
+        return
+    # Initialize default cost centers
+    default_centers = [
+        CostCenter(name="دفتر", name_en="Office"),
+        CostCenter(name="قیر", name_en="Bitumen"),
+        CostCenter(name="پارادیزو", name_en="Paradiso")
+    ]
+    inserted = 0
+    for center in default_centers:
+        try:
+            result = await db.cost_centers.update_one(
+                {"name": center.name},
+                {"$setOnInsert": center.model_dump()},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # upsert همزمان worker دیگر
+            continue
+        inserted += result.upserted_id is not None
+    if inserted:
+        await bump_collection_revision("cost_centers")
+
+@app.on_event("startup")
+async def start_cache_watcher():
+    background_tasks.append(asyncio.create_task(watch_collection_revisions()))
+
+async def merge_duplicate_counters():
+    # کد قدیمی شمارنده (find_one سپس insert_one) ممکن است چند سند برای یک شمارنده ساخته باشد؛
+    # بزرگ‌ترین مقدار نگه داشته می‌شود تا هیچ شماره‌ای دوباره صادر نشود
+    duplicates = await db.counters.aggregate([
+        {"$group": {
+            "_id": {"type": "$type", "year": "$year", "collection": "$collection"},
+            "ids": {"$push": "$_id"},
+            "counter": {"$max": "$counter"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]).to_list(None)
+    for group in duplicates:
+        keep, *extra = group['ids']
+        await db.counters.update_one({"_id": keep}, {"$set": {"counter": group['counter']}})
+        await db.counters.delete_many({"_id": {"$in": extra}})
+        logging.warning("Merged %d duplicate counters for %s", len(extra) + 1, group['_id'])
+
+@app.on_event("startup")
+async def ensure_indexes():
+    for collection in ("goods_requests", "payment_requests", "project_proposals"):
+        await db[collection].create_index("id")
+        await db[collection].create_index("updated_at")
+        await db[collection].create_index("created_at")
+        await db[collection].create_index("revision")
+        await db[collection].create_index([("status", 1), ("updated_at", 1)])
+    # شمارنده‌های سالانه با upsert ساخته می‌شوند؛ بدون ایندکس یکتا دو درخواست همزمان دو شمارنده می‌سازند
+    await merge_duplicate_counters()
+    await create_unique_index(
+        "counters",
+        [("type", 1), ("year", 1)],
+        partialFilterExpression={"year": {"$exists": True}}
+    )
+    await db.tombstones.create_index("revision")
+    await db.tombstones.create_index([("collection", 1), ("id", 1)])
+    await db.search_index.create_index([("kind", 1), ("entity_id", 1)], unique=True)
+    await db.search_index.create_index([("search_text", "text")], default_language="none")
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index("expires_at", expireAfterSeconds=0)
+    # انتقال اعلان‌های خوانده‌نشده قدیمی به بایگانی در هر اجرای زمان‌بند
+    await db.notifications.create_index([("is_read", 1), ("created_at", 1)])
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    await db.reminder_rounds.create_index("expires_at", expireAfterSeconds=0)
+    await db.notifications.create_index(
+        "dedup_key",
+        unique=True,
+        partialFilterExpression={"dedup_key": {"$exists": True}}
+    )
+    await db.price_observations.create_index("id", unique=True)
+    await db.price_observations.create_index([("item_key", 1), ("observed_at", -1)])
+    await db.price_observations.create_index("request_id")
+    if not await db.search_index.count_documents({}, limit=1):
+        background_tasks.append(asyncio.create_task(rebuild_search_index()))
+    if not await db.price_observations.count_documents({}, limit=1):
+        background_tasks.append(asyncio.create_task(rebuild_price_observations()))
+
+@app.on_event("startup")
+async def backfill_revisions(batch_size: int = 1000):
+    # اسناد قدیمی که قبل از همگام‌سازی ساخته شده‌اند revision ندارند؛ پس از اتمام فقط marker خوانده می‌شود
+    if await db.migrations.find_one({"_id": "backfill_revisions", "completed_at": {"$exists": True}}):
+        return
+    for collection, _ in WORKFLOW_COLLECTIONS.values():
+        while True:
+            legacy = await db[collection].find(
+                {"revision": {"$exists": False}}, {"_id": 0, "id": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not legacy:
+                break
+            first = await reserve_revisions(len(legacy))
+            await db[collection].bulk_write([
+                UpdateOne({"id": doc['id'], "revision": {"$exists": False}}, {"$set": {"revision": first + i}})
+                for i, doc in enumerate(legacy)
+            ], ordered=False)
+    await db.migrations.update_one(
+        {"_id": "backfill_revisions"},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
 app.include_router(api_router)
 
+# ==================== Middleware ====================
+def bearer_payload(authorization: Optional[str]) -> Optional[Dict[str, Any]]:
+    # میان‌افزارها قبل از Depends اجرا می‌شوند و توکن را خودشان بررسی می‌کنند
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        return None
+
+def profiling_admin(headers: Dict[str, str]) -> Optional[str]:
+    payload = bearer_payload(headers.get('authorization'))
+    if not payload or UserRole.ADMIN not in payload.get('roles', []):
+        return None
+    return payload.get('user_id')
+
+app.add_middleware(
+    ProfilingMiddleware,
+    store=profile_store,
+    authorize=profiling_admin,
+    sample_interval=float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))
+)
+
+# ==================== Idempotency ====================
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+
+def idempotency_scope(request) -> Optional[str]:
+    payload = bearer_payload(request.headers.get('authorization'))
+    return payload.get('user_id') if payload else None
+
+app.add_middleware(
+    IdempotencyMiddleware,
+    collection=db.idempotency_keys,
+    identify=idempotency_scope,
+    ttl=timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+)
+
+# ==================== Metrics ====================
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+app.add_middleware(MetricsMiddleware)
+
+# ==================== Compression ====================
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', '4'))
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1869,4 +3551,8 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    if SCHEDULER_ENABLED:
+        await scheduler.release()
     client.close()
\ No newline at end of file
@@ -20,7 +20,11 @@ const PaymentRequestList = () => {
 
   const fetchRequests = async () => {
     try {
-      const response = await axios.get(`${API}/payment-requests`);
+      const response = await axios.get(`${API}/payment-requests`, {
+        params: {
+          fields: 'request_number,request_type,request_type_other,total_amount,status,requester_name,created_at'
+        }
+      });
       setRequests(response.data);
     } catch (error) {
       console.error('Failed to fetch payment requests', error);